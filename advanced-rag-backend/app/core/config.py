@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import List
+from typing import Dict, List
 
 from pydantic import BaseSettings
 
@@ -18,6 +18,113 @@ class Settings(BaseSettings):
 
     # AI / LLM
     GROQ_API_KEY: str  # <--- Added this field so the app can read the Env Var
+    LLM_TIMEOUT_SECONDS: float = 60.0
+    LLM_MAX_CONNECTIONS: int = 500  # concurrent in-flight LLM requests per worker
+    RETRIEVAL_WORKERS: int = 4  # threads for query embedding + FAISS search
+    # Research mode: sub-questions run concurrently, each with its own timeout
+    RESEARCH_CONCURRENCY: int = 5
+    RESEARCH_STEP_TIMEOUT_SECONDS: float = 30.0
+    RESEARCH_STREAM_SUB_ANSWERS: bool = True  # emit sub_answer events on /chat/query/stream
+
+    # FAISS in-memory index cache (per worker)
+    FAISS_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    FAISS_CACHE_POLICY: str = "lru"  # "lru" or "lfu"
+    # Append-only segments allowed before a background merge into the base snapshot
+    FAISS_COMPACT_SEGMENTS: int = 16
+
+    # FAISS index type per corpus size: {min_vectors: "flat" | "fp16" | "sq8" | "pq" | "hnsw" | "ivf" | "ivfpq"}.
+    # A user's index is rebuilt in the background when it crosses a threshold.
+    # Compressed flat kinds keep fewer bytes per vector resident (at 384 dims: flat 1536,
+    # fp16 768, sq8 384, pq FAISS_PQ_M), e.g. {0: "flat", 5_000: "sq8", 100_000: "hnsw", ...}.
+    FAISS_INDEX_TIERS: Dict[int, str] = {0: "flat", 100_000: "hnsw", 2_000_000: "ivfpq"}
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 80
+    FAISS_PQ_M: int = 48  # sub-quantizers; must divide the embedding dimension
+    FAISS_TRAIN_SAMPLE: int = 200_000
+    # Recall-vs-latency knobs applied at search time
+    FAISS_HNSW_EF_SEARCH: int = 64
+    FAISS_IVF_NPROBE: int = 16
+    # Document-filtered searches over at most this many vectors are done exactly
+    FAISS_EXACT_FILTER_MAX: int = 4096
+    # Keep a float16 copy of every vector in the (memory-mapped, not resident) chunk store,
+    # and re-score FAISS_RERANK_FACTOR x top_k candidates of sq8/pq/ivfpq indexes with it
+    FAISS_EXACT_RERANK: bool = True
+    FAISS_RERANK_FACTOR: int = 4
+    # Sample queries used to measure recall@10 of a freshly built lossy index against
+    # exact search (logged, and reported per user); 0 disables
+    FAISS_RECALL_SAMPLE: int = 100
+    # "ip": vectors are L2-normalized and search scores are cosine similarities in [-1, 1];
+    # "l2": raw squared L2 distances. Indexes built with the other metric are converted
+    # from their stored vectors (flat on load, ANN kinds by the background rebuild).
+    FAISS_METRIC: str = "ip"
+    # Vector hits below this cosine similarity are dropped before prompting ("ip" only; -1 keeps all)
+    RETRIEVAL_MIN_SCORE: float = -1.0
+
+    # Hybrid retrieval: BM25 keyword hits fused with vector hits by reciprocal rank fusion
+    HYBRID_SEARCH_ENABLED: bool = True
+    HYBRID_CANDIDATES: int = 20  # hits taken from each retriever before fusion
+    HYBRID_RRF_K: int = 60
+
+    # Exact answer cache (per worker), keyed on user, normalized query, mode,
+    # selected documents and the user's index version
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 2000
+    ANSWER_CACHE_TTL_SECONDS: float = 600.0
+    # Concurrent identical chat requests (/chat/query or /chat/query/stream)
+    # share one retrieval + LLM call; a stream joining another request gets
+    # the finished answer as a single token event
+    SINGLE_FLIGHT_ENABLED: bool = True
+    # Semantic answer cache: paraphrased queries whose vectors are at least this
+    # cosine-similar to a cached one (same mode/documents/index version) reuse its answer
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_MAX_USERS: int = 1000
+    SEMANTIC_CACHE_MAX_ENTRIES_PER_USER: int = 256
+
+    # Prompt context packing: token budget for retrieved context, per Groq model
+    CONTEXT_TOKEN_BUDGET: int = 3000  # models not listed below
+    CONTEXT_TOKEN_BUDGETS: Dict[str, int] = {
+        "llama-3.1-8b-instant": 3000,
+        "llama-3.3-70b-versatile": 6000,
+    }
+    # HF tokenizer.json used to count tokens; "" = estimate from CONTEXT_CHARS_PER_TOKEN
+    CONTEXT_TOKENIZER_PATH: str = ""
+    CONTEXT_CHARS_PER_TOKEN: float = 4.0
+
+    # Optional cross-encoder re-ranking of retrieved candidates (fastembed ONNX, CPU)
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL: str = "Xenova/ms-marco-MiniLM-L-6-v2"
+    RERANK_CANDIDATES: int = 24  # candidates re-scored per query
+    RERANK_TOP_K: int = 5  # chunks kept per query after re-ranking
+    RERANK_BATCH_SIZE: int = 16
+    RERANK_BUDGET_MS: float = 150.0  # past this, unscored candidates keep retrieval order
+
+    # Persistent chunk-embedding cache keyed by (model, sha256(text)); "" = data/embedding_cache.sqlite3
+    EMBED_CACHE_ENABLED: bool = True
+    EMBED_CACHE_PATH: str = ""
+    EMBED_CACHE_HOT_ENTRIES: int = 20_000  # in-memory LRU in front of the file
+    # Least recently used rows beyond this are pruned from the file (~0.8 KB
+    # each, chunk and shared query vectors alike); 0 = unbounded
+    EMBED_CACHE_MAX_ROWS: int = 500_000
+
+    # Chunk text is read from document_chunks for each query's hits; hot LRU per worker
+    CHUNK_TEXT_CACHE_ENTRIES: int = 5000
+
+    # Query-vector LRU (per worker); SHARED also keeps query vectors in the embedding cache file
+    QUERY_CACHE_MAX_ENTRIES: int = 10_000
+    QUERY_CACHE_SHARED: bool = False
+
+    # Background ingestion workers (DB-backed job queue)
+    INGEST_WORKERS: int = 2
+    INGEST_POLL_SECONDS: float = 2.0
+    INGEST_STALE_SECONDS: int = 600  # running jobs without a heartbeat this long are re-queued
+    INGEST_MAX_ATTEMPTS: int = 3
+    # Chunks embedded + indexed per step; bounds ingestion memory regardless of document size
+    INGEST_BATCH_SIZE: int = 256
+    # Page-parallel PDF extraction in a process pool (0 workers = one per CPU)
+    PDF_EXTRACT_WORKERS: int = 0
+    PDF_PAGES_PER_TASK: int = 8
+    PDF_PAGE_TIMEOUT_SECONDS: float = 30.0  # a page taking longer is skipped
 
     class Config:
         env_file = ".env"
@@ -8,7 +8,9 @@ from app.core.db import Base, engine
 from app.routers import auth, documents, chat, analytics
 
 # ✅ import models so SQLAlchemy registers tables
-from app.models import user, document, analytics as analytics_model  # noqa: F401
+from app.models import user, document, ingestion, analytics as analytics_model  # noqa: F401
+from app.services.ingestion import start_workers, stop_workers
+from app.services.reranker import warm_up as warm_up_reranker
 
 settings = get_settings()
 
@@ -45,6 +47,12 @@ def create_app() -> FastAPI:
     app.include_router(chat.router, prefix=settings.API_PREFIX)
     app.include_router(analytics.router, prefix=settings.API_PREFIX)
 
+    # background ingestion workers (resume any jobs queued before a restart)
+    app.add_event_handler("startup", start_workers)
+    app.add_event_handler("shutdown", stop_workers)
+    # load the optional re-ranking model before the first query needs it
+    app.add_event_handler("startup", warm_up_reranker)
+
     @app.get("/")
     def health():
         return {"status": "ok"}
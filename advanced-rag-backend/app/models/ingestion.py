@@ -0,0 +1,67 @@
+# app/models/ingestion.py
+from __future__ import annotations
+
+import uuid
+
+from sqlalchemy import (
+    Column,
+    String,
+    DateTime,
+    ForeignKey,
+    Integer,
+    Float,
+    Text,
+    func,
+)
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import backref, relationship
+
+from app.core.db import Base
+
+
+class IngestionJob(Base):
+    """
+    One queued document ingestion (extract -> chunk -> embed -> index).
+
+    The table doubles as the work queue: workers claim `queued` rows with a
+    conditional UPDATE, so jobs survive restarts and are never run twice.
+    """
+
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    document_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("documents.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+
+    # queued | running | succeeded | failed
+    status = Column(String, nullable=False, default="queued", index=True)
+    progress = Column(Float, nullable=False, default=0.0)  # 0.0 - 1.0
+    stage = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    # bumped on every progress update; a stale heartbeat means the worker died
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    # relationships (deleting a Document removes its jobs, like its chunks)
+    document = relationship(
+        "Document",
+        backref=backref("ingestion_jobs", cascade="all, delete-orphan"),
+    )
@@ -11,6 +11,11 @@ from app.models.analytics import QueryAnalytics
 from app.models.document import Document
 from app.routers.dependencies import get_current_user
 from app.models.user import User
+from app.services.answer_cache import get_answer_cache_stats
+from app.services.chunk_text import get_chunk_text_cache_stats
+from app.services.embedding_cache import get_embedding_cache
+from app.services.embeddings import get_query_cache_stats
+from app.services.faiss_store import get_cache_stats, get_index_info
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
@@ -37,13 +42,27 @@ def analytics_overview(db: Session = Depends(get_db)) -> Dict[str, Any]:
     }
 
 
+@router.get("/cache")
+def cache_stats() -> Dict[str, Any]:
+    """
+    In-process cache counters for this worker (hits, misses, loads, evictions).
+    """
+    return {
+        "faiss_indices": get_cache_stats(),
+        "embeddings": get_embedding_cache().stats(),
+        "query_embeddings": get_query_cache_stats(),
+        "answers": get_answer_cache_stats(),
+        "chunk_texts": get_chunk_text_cache_stats(),
+    }
+
+
 @router.get("/user")
 def user_analytics(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ) -> Dict[str, Any]:
     """
-    Per-user analytics (recent queries, etc.)
+    Per-user analytics (recent queries, index kind/size/recall, etc.)
     """
     rows: List[QueryAnalytics] = (
         db.query(QueryAnalytics)
@@ -67,4 +86,5 @@ def user_analytics(
 
     return {
         "recent_queries": recent,
+        "index": get_index_info(str(current_user.id)),
     }
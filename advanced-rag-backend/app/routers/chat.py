@@ -1,23 +1,28 @@
 # app/routers/chat.py
 
+import json
+import logging
 from datetime import datetime
-from typing import Any
+from typing import Any, AsyncIterator, Dict
 
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from app.core.db import get_db          # ✅ matches your main.py (Base, engine)
+from app.core.db import SessionLocal, get_db          # ✅ matches your main.py (Base, engine)
 from app.models.user import User
 from app.routers.dependencies import get_current_user
 from app.schemas.chat import ChatQueryRequest, ChatResponse, AgentMode
-from app.services.rag_pipeline import run_rag_query
+from app.services.rag_pipeline import run_rag_query, stream_rag_query
+
+logger = logging.getLogger(__name__)
 
 # ✅ Define router BEFORE using @router.post
 router = APIRouter(prefix="/chat", tags=["Chat"])  # final path: /api/chat/... because main.py adds /api
 
 
 @router.post("/query", response_model=ChatResponse)
-def chat_query(
+async def chat_query(
     body: ChatQueryRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
@@ -35,10 +40,15 @@ def chat_query(
     """
     # Normalize agent_mode: fall back to default if missing/null
     requested_mode = body.agent_mode or AgentMode.default
+    user_id = str(current_user.id)
+
+    # Hand the pooled connection back while the LLM is generating; the
+    # session checks one out again for the analytics write at the end.
+    db.close()
 
-    answer, sources, token_usage, latency_ms = run_rag_query(
+    answer, sources, token_usage, latency_ms = await run_rag_query(
         db=db,
-        user_id=str(current_user.id),
+        user_id=user_id,
         query=body.query,
         agent_mode=requested_mode,
         selected_document_ids=body.selected_document_ids,
@@ -53,3 +63,60 @@ def chat_query(
         conversation_id=body.conversation_id or "",
         created_at=datetime.utcnow(),
     )
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@router.post("/query/stream")
+async def chat_query_stream(
+    body: ChatQueryRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+) -> StreamingResponse:
+    """
+    Streaming variant of /chat/query as Server-Sent Events:
+
+      event: sources     {"sources": [...]}
+      event: sub_answer  {"index", "question", "answer", "ok"}  (research mode)
+      event: token       {"text": "..."}  (repeated)
+      event: done        {"token_usage", "latency_ms", "used_agent_mode",
+                          "conversation_id", "created_at"}
+
+    An `error` event replaces `done` if the pipeline fails mid-stream.
+    """
+    requested_mode = body.agent_mode or AgentMode.default
+    user_id = str(current_user.id)
+    db.close()
+
+    async def events() -> AsyncIterator[str]:
+        # The request-scoped session is finalized before a streaming body
+        # runs, so the stream owns its own session for the analytics write.
+        stream_db = SessionLocal()
+        try:
+            async for event, payload in stream_rag_query(
+                db=stream_db,
+                user_id=user_id,
+                query=body.query,
+                agent_mode=requested_mode,
+                selected_document_ids=body.selected_document_ids,
+            ):
+                if event == "done":
+                    payload = {
+                        **payload,
+                        "conversation_id": body.conversation_id or "",
+                        "created_at": datetime.utcnow().isoformat(),
+                    }
+                yield _sse(event, payload)
+        except Exception as e:
+            logger.exception("Streaming chat query failed")
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
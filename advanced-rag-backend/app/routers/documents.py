@@ -5,21 +5,19 @@ import os
 import shutil
 import uuid
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
-import numpy as np  # Added for vector conversion
-import pdfplumber
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
 from sqlalchemy.orm import Session
 
 from app.core.db import get_db
-from app.models.document import Document, DocumentChunk
+from app.models.document import Document
+from app.models.ingestion import IngestionJob
 from app.models.user import User
 from app.routers.dependencies import get_current_user
-from app.schemas.documents import DocumentListResponse, DocumentResponse
-from app.services.embeddings import embed_texts
-# Imported clear_user_index for the fix
-from app.services.faiss_store import add_embeddings, clear_user_index
+from app.schemas.documents import DocumentListResponse, DocumentResponse, IngestionJobResponse
+from app.services.faiss_store import remove_document
+from app.services.ingestion import enqueue_ingestion, notify_workers
 
 logger = logging.getLogger(__name__)
 
@@ -40,75 +38,34 @@ def _ensure_upload_dir(user_id: uuid.UUID) -> str:
     return path
 
 
-# ------------------------------
-# Text extraction + chunking
-# ------------------------------
-
-def _extract_text_from_pdf(path: str) -> str:
-    """
-    Extract text from a PDF using pdfplumber (no PyMuPDF/fitz dependency).
-    """
-    parts: List[str] = []
-    try:
-        with pdfplumber.open(path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text() or ""
-                if text.strip():
-                    parts.append(text)
-    except Exception as e:
-        logger.warning("Failed to parse PDF %s with pdfplumber: %s", path, e)
-        return ""
-
-    text = "\n\n".join(parts)
-    logger.info("PDF text extracted from %s, length=%d chars", path, len(text))
-    return text
-
-
-def _extract_text_generic(path: str) -> str:
-    """
-    Fallback for txt/md/etc. Very simple. You can extend to DOCX later.
-    """
-    try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            text = f.read()
-        logger.info("Generic text extracted from %s, length=%d chars", path, len(text))
-        return text
-    except Exception as e:
-        logger.warning("Failed to read %s as text: %s", path, e)
-        return ""
-
-
-def _simple_chunk(text: str, max_chars: int = 1000, overlap: int = 200) -> List[str]:
-    text = text.strip()
-    if not text:
-        return []
-
-    chunks: List[str] = []
-    n = len(text)
-    start = 0
-
-    while start < n:
-        end = min(start + max_chars, n)
-        chunks.append(text[start:end])
-        if end == n:
-            break
-        start = end - overlap
-
-    return [c.strip() for c in chunks if c.strip()]
+def _document_payload(doc: Document, job: Optional[IngestionJob] = None) -> Dict[str, Any]:
+    return {
+        "id": str(doc.id),
+        "filename": doc.filename,
+        "size_bytes": doc.size_bytes,
+        "content_type": doc.content_type,
+        "created_at": doc.created_at.isoformat(),
+        "num_chunks": doc.num_chunks or 0,
+        "job_id": str(job.id) if job else None,
+        "status": job.status if job else None,
+    }
 
 
 # ------------------------------
 # Routes
 # ------------------------------
 
-@router.post("/upload", response_model=DocumentListResponse)
-async def upload_documents(
+@router.post("/upload", response_model=DocumentListResponse, status_code=status.HTTP_202_ACCEPTED)
+def upload_documents(
     files: List[UploadFile] = File(...),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ) -> Dict[str, Any]:
     """
-    Upload one or more documents, extract text, chunk, embed, push to FAISS.
+    Upload one or more documents and queue them for ingestion
+    (extract, chunk, embed, push to FAISS) by the background workers.
+
+    Returns immediately; poll GET /documents/jobs/{job_id} for progress.
     """
     if not files:
         raise HTTPException(
@@ -118,7 +75,7 @@ async def upload_documents(
 
     user_id = current_user.id
     user_dir = _ensure_upload_dir(user_id)
-    created_docs: List[Dict[str, Any]] = []
+    queued = []
 
     for f in files:
         orig_name = f.filename or "document"
@@ -133,7 +90,7 @@ async def upload_documents(
         size_bytes = os.path.getsize(stored_path)
         content_type = f.content_type or "application/octet-stream"
 
-        # Create Document row
+        # Create Document row + its ingestion job in the same transaction
         doc = Document(
             id=uuid.uuid4(),
             user_id=user_id,
@@ -146,112 +103,53 @@ async def upload_documents(
             created_at=datetime.utcnow(),
         )
         db.add(doc)
-        db.commit()
-        db.refresh(doc)
-
-        # Extract text
-        if ext == ".pdf":
-            full_text = _extract_text_from_pdf(stored_path)
-        else:
-            full_text = _extract_text_generic(stored_path)
-
-        if not full_text.strip():
-            logger.warning(
-                "No extractable text for document %s (path=%s, ext=%s). "
-                "num_chunks will stay 0.",
-                doc.id,
-                stored_path,
-                ext,
-            )
-            created_docs.append(
-                {
-                    "id": str(doc.id),
-                    "filename": doc.filename,
-                    "size_bytes": doc.size_bytes,
-                    "content_type": doc.content_type,
-                    "created_at": doc.created_at.isoformat(),
-                    "num_chunks": doc.num_chunks or 0,
-                }
-            )
-            continue
-
-        # Chunk
-        chunks = _simple_chunk(full_text, max_chars=1000, overlap=200)
-        logger.info(
-            "Document %s chunked into %d chunks (len(text)=%d).",
-            doc.id,
-            len(chunks),
-            len(full_text),
-        )
+        job = enqueue_ingestion(db, doc)
+        # built before commit, which would expire (and re-SELECT) both rows
+        queued.append(_document_payload(doc, job))
 
-        if not chunks:
-            logger.warning("Chunking produced 0 chunks for document %s.", doc.id)
-            created_docs.append(
-                {
-                    "id": str(doc.id),
-                    "filename": doc.filename,
-                    "size_bytes": doc.size_bytes,
-                    "content_type": doc.content_type,
-                    "created_at": doc.created_at.isoformat(),
-                    "num_chunks": doc.num_chunks or 0,
-                }
-            )
-            continue
-
-        # Insert chunks
-        chunk_rows: List[DocumentChunk] = []
-        for idx, chunk_text in enumerate(chunks):
-            ch = DocumentChunk(
-                id=uuid.uuid4(),
-                document_id=doc.id,
-                user_id=user_id,
-                chunk_index=idx,
-                text=chunk_text,
-                created_at=datetime.utcnow(),
-            )
-            db.add(ch)
-            chunk_rows.append(ch)
-
-        db.commit()
-        for ch in chunk_rows:
-            db.refresh(ch)
-
-        # Embed + FAISS
-        texts_for_embed = [c.text for c in chunk_rows]
-        # FIX: Ensure vectors are numpy array for FAISS
-        vectors = np.array(embed_texts(texts_for_embed))
-        
-        metadatas = [
-            {
-                "chunk_id": str(ch.id),
-                "document_id": str(doc.id),
-                "filename": doc.filename,
-                "text": ch.text,
-            }
-            for ch in chunk_rows
-        ]
-        
-        # FIX: Match arguments to faiss_store.py (user_id as UUID, embeddings param)
-        add_embeddings(user_id=user_id, embeddings=vectors, metadatas=metadatas)
-
-        # Update num_chunks
-        doc.num_chunks = len(chunk_rows)
-        db.add(doc)
-        db.commit()
-        db.refresh(doc)
-
-        created_docs.append(
-            {
-                "id": str(doc.id),
-                "filename": doc.filename,
-                "size_bytes": doc.size_bytes,
-                "content_type": doc.content_type,
-                "created_at": doc.created_at.isoformat(),
-                "num_chunks": doc.num_chunks or 0,
-            }
+    db.commit()
+    notify_workers()
+
+    return {"documents": queued}
+
+
+@router.get("/jobs/{job_id}", response_model=IngestionJobResponse)
+def get_ingestion_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """
+    Status/progress of one ingestion job.
+    """
+    try:
+        job_uuid = uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid job_id")
+
+    job = (
+        db.query(IngestionJob)
+        .filter(
+            IngestionJob.id == job_uuid,
+            IngestionJob.user_id == current_user.id,
         )
+        .first()
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
 
-    return {"documents": created_docs}
+    return {
+        "id": str(job.id),
+        "document_id": str(job.document_id),
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
 
 
 @router.get("", response_model=DocumentListResponse)
@@ -269,18 +167,20 @@ def list_documents(
         .all()
     )
 
+    # Latest ingestion job per document, so the UI can show processing state
+    latest_jobs: Dict[Any, IngestionJob] = {}
+    if docs:
+        jobs = (
+            db.query(IngestionJob)
+            .filter(IngestionJob.document_id.in_([d.id for d in docs]))
+            .order_by(IngestionJob.created_at)
+            .all()
+        )
+        for job in jobs:
+            latest_jobs[job.document_id] = job
+
     return {
-        "documents": [
-            {
-                "id": str(d.id),
-                "filename": d.filename,
-                "size_bytes": d.size_bytes,
-                "content_type": d.content_type,
-                "created_at": d.created_at.isoformat(),
-                "num_chunks": d.num_chunks or 0,
-            }
-            for d in docs
-        ]
+        "documents": [_document_payload(d, latest_jobs.get(d.id)) for d in docs]
     }
 
 
@@ -291,8 +191,9 @@ def delete_document(
     current_user: User = Depends(get_current_user),
 ):
     """
-    Deletes a document from the DB and clears the user's FAISS index.
-    This prevents 'Ghost Memory' where the AI remembers deleted files.
+    Deletes a document from the DB and removes only its vectors from the
+    user's FAISS index, so no 'Ghost Memory' remains and other documents
+    stay searchable.
     """
     try:
         doc_uuid = uuid.UUID(document_id)
@@ -314,8 +215,7 @@ def delete_document(
     db.delete(doc)
     db.commit()
 
-    # 2. NUCLEAR FIX: Clear the Search Index to remove "Ghost Data"
-    # This ensures no data from this deleted file remains in memory.
-    clear_user_index(current_user.id)
+    # 2. Drop this document's vectors from the search index (by stable vector ID)
+    removed = remove_document(current_user.id, doc_uuid)
 
-    return {"message": "Document deleted and search index cleared. Please re-upload other documents if needed."}
+    return {"message": "Document deleted.", "removed_vectors": removed}
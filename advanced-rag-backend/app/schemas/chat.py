@@ -28,6 +28,9 @@ class SourceChunk(BaseModel):
     document_id: str
     filename: str
     snippet: str
+    # cosine similarity from the vector search (L2 distance with FAISS_METRIC
+    # "l2"); None for hits found only by keyword search
+    vector_score: Optional[float] = None
 
 
 class TokenUsage(BaseModel):
@@ -13,6 +13,9 @@ class DocumentBase(BaseModel):
     content_type: str
     created_at: str
     num_chunks: Optional[int] = 0
+    # latest ingestion job (None for documents ingested before the job queue)
+    job_id: Optional[str] = None
+    status: Optional[str] = None
 
     class Config:
         # Pydantic v2
@@ -34,3 +37,19 @@ class DocumentListResponse(BaseModel):
     }
     """
     documents: List[DocumentBase]
+
+
+class IngestionJobResponse(BaseModel):
+    """
+    Status of a background ingestion job (GET /documents/jobs/{job_id}).
+    """
+    id: str
+    document_id: str
+    status: str  # queued | running | succeeded | failed
+    stage: Optional[str] = None
+    progress: float
+    error: Optional[str] = None
+    attempts: int
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
@@ -1,7 +1,8 @@
 # app/services/agents.py
 
-from typing import List
+from typing import List, Optional, Sequence, Union
 from app.schemas.chat import AgentMode
+from app.services.context_packing import ContextChunk, pack_context
 
 
 def plan_research_steps(query: str) -> List[str]:
@@ -26,19 +27,25 @@ def plan_research_steps(query: str) -> List[str]:
 
 def build_rag_prompt(
     query: str,
-    context_chunks: List[str],
+    context_chunks: Sequence[Union[str, ContextChunk]],
     mode: AgentMode,
+    token_budget: Optional[int] = None,
 ) -> str:
     """
     Build the main LLM prompt for all agent modes.
 
+    Retrieved chunks (best first) are packed into at most `token_budget`
+    tokens of context: overlapping neighbours from the same document are
+    merged and chunks that no longer fit are dropped.
+
     IMPORTANT:
     - If there is NO context, don't force the model to say
       "I cannot find it in the uploaded documents."
     - Default mode should behave like a normal assistant when no docs are available.
     """
 
-    has_context = len(context_chunks) > 0
+    snippets = pack_context(context_chunks, token_budget)
+    has_context = len(snippets) > 0
 
     if mode == AgentMode.default:
         if has_context:
@@ -77,7 +84,7 @@ def build_rag_prompt(
 
     if has_context:
         context_text = "\n\n".join(
-            f"[Snippet {i+1}]\n{chunk}" for i, chunk in enumerate(context_chunks)
+            f"[Snippet {i+1}]\n{chunk}" for i, chunk in enumerate(snippets)
         )
         context_block = context_text
     else:
@@ -0,0 +1,211 @@
+# app/services/answer_cache.py
+
+from __future__ import annotations
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.core.config import get_settings
+from app.services.embeddings import normalize_query
+
+settings = get_settings()
+
+CachedAnswer = Tuple[str, List[Dict[str, Any]]]
+
+
+class AnswerKey(NamedTuple):
+    user_id: str
+    query: str
+    agent_mode: str
+    document_ids: Tuple[str, ...]
+    index_version: str
+
+
+def answer_key(
+    user_id: str,
+    query: str,
+    agent_mode: str,
+    selected_document_ids: Optional[List[str]],
+    index_version: str,
+) -> AnswerKey:
+    """
+    Cache key for a chat request. `index_version` changes whenever the
+    user's index does, so answers over an older corpus are never served.
+    """
+    return AnswerKey(
+        user_id=str(user_id),
+        query=normalize_query(query),
+        agent_mode=agent_mode,
+        document_ids=tuple(sorted({str(d) for d in selected_document_ids or []})),
+        index_version=index_version,
+    )
+
+
+class AnswerCache:
+    """
+    Per-worker LRU of final answers (answer text + sources) with a TTL.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[AnswerKey, Tuple[float, CachedAnswer]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, key: AnswerKey) -> Optional[CachedAnswer]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            answer, sources = entry[1]
+        # callers may annotate the sources they return
+        return answer, copy.deepcopy(sources)
+
+    def put(self, key: AnswerKey, answer: str, sources: List[Dict[str, Any]]) -> None:
+        if self.max_entries <= 0:
+            return
+        value = (answer, copy.deepcopy(sources))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SemanticAnswerCache:
+    """
+    Per-user cache of answers to past queries, found by query-vector
+    similarity so paraphrases of an answered question hit too.
+
+    Each user gets a small exact inner-product FAISS index over the
+    normalized vectors of their cached queries. Entries only match requests
+    with the same agent mode and document selection, and a user's whole
+    cache is dropped as soon as their index version changes.
+    """
+
+    def __init__(self, max_users: int, max_entries_per_user: int, ttl_seconds: float, threshold: float):
+        self.max_users = max_users
+        self.max_entries_per_user = max_entries_per_user
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        # user_id -> {"version", "index", "vectors", "entries": [(expires, scope, answer, sources)]}
+        self._users: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalized(vector: np.ndarray) -> np.ndarray:
+        vector = np.array(vector, dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _user(self, key: AnswerKey, create: bool) -> Optional[Dict[str, Any]]:
+        user = self._users.get(key.user_id)
+        if user is not None and user["version"] != key.index_version:
+            # corpus changed: nothing cached for this user is valid any more
+            del self._users[key.user_id]
+            user = None
+        if user is None and create:
+            user = {"version": key.index_version, "index": None, "vectors": [], "entries": []}
+            self._users[key.user_id] = user
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        if user is not None:
+            self._users.move_to_end(key.user_id)
+        return user
+
+    def get(self, key: AnswerKey, query_vector: np.ndarray) -> Optional[CachedAnswer]:
+        vector = self._normalized(query_vector)
+        scope = (key.agent_mode, key.document_ids)
+        now = time.monotonic()
+        with self._lock:
+            user = self._user(key, create=False)
+            if user is not None and user["index"] is not None and user["index"].ntotal:
+                k = min(8, user["index"].ntotal)
+                sims, positions = user["index"].search(vector, k)
+                for sim, pos in zip(sims[0].tolist(), positions[0].tolist()):
+                    if pos < 0 or sim < self.threshold:
+                        break
+                    expires, entry_scope, answer, sources = user["entries"][pos]
+                    if entry_scope == scope and expires >= now:
+                        self.hits += 1
+                        return answer, copy.deepcopy(sources)
+            self.misses += 1
+            return None
+
+    def put(self, key: AnswerKey, query_vector: np.ndarray, answer: str, sources: List[Dict[str, Any]]) -> None:
+        if self.max_entries_per_user <= 0:
+            return
+        vector = self._normalized(query_vector)
+        entry = (time.monotonic() + self.ttl_seconds, (key.agent_mode, key.document_ids), answer, copy.deepcopy(sources))
+        with self._lock:
+            user = self._user(key, create=True)
+            user["vectors"].append(vector[0])
+            user["entries"].append(entry)
+            if len(user["entries"]) > self.max_entries_per_user:
+                # drop the oldest quarter and rebuild (the index is tiny)
+                drop = max(1, self.max_entries_per_user // 4)
+                user["vectors"] = user["vectors"][drop:]
+                user["entries"] = user["entries"][drop:]
+                user["index"] = None
+            if user["index"] is None:
+                user["index"] = faiss.IndexFlatIP(vector.shape[1])
+                user["index"].add(np.stack(user["vectors"]))
+            else:
+                user["index"].add(vector)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "entries": sum(len(user["entries"]) for user in self._users.values()),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+answer_cache = AnswerCache(settings.ANSWER_CACHE_MAX_ENTRIES, settings.ANSWER_CACHE_TTL_SECONDS)
+
+semantic_cache = SemanticAnswerCache(
+    max_users=settings.SEMANTIC_CACHE_MAX_USERS,
+    max_entries_per_user=settings.SEMANTIC_CACHE_MAX_ENTRIES_PER_USER,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+)
+
+
+def get_answer_cache_stats() -> Dict[str, Any]:
+    return {**answer_cache.stats(), "semantic": semantic_cache.stats()}
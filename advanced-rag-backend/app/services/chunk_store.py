@@ -0,0 +1,307 @@
+# app/services/chunk_store.py
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import uuid
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.index_factory import DIMENSION
+
+logger = logging.getLogger(__name__)
+
+# Fixed-width columns, one row per vector, all row-aligned.
+# Rows are appended in vector-ID order, so the `ids` column stays sorted and
+# an ID -> row lookup is a binary search over a memory-mapped array.
+_COLUMNS = {
+    "ids": (np.int64, ()),          # FAISS vector ID
+    "chunk_ids": (np.uint64, (2,)),  # DocumentChunk.id as 16 raw bytes
+    "doc_ids": (np.uint64, (2,)),    # Document.id as 16 raw bytes
+    "chunk_index": (np.int32, ()),   # -1 if unknown (metadata migrated from old indexes)
+}
+
+# Optional float16 copy of each row's vector (for exact re-scoring of
+# compressed-index hits). Written only if it covers every row, so it is either
+# complete or ignored until the next rewrite backfills it.
+_VECTORS = "vectors"
+_VECTOR_DTYPE = np.float16
+
+# Chunk text used to be kept here too (a blob + offsets column); it now lives
+# only in document_chunks.text, and these files are removed on open.
+_LEGACY_FILES = ("text", "text_end")
+
+
+def _uuid_to_words(value: Any) -> np.ndarray:
+    return np.frombuffer(uuid.UUID(str(value)).bytes, dtype=np.uint64)
+
+
+def _words_to_uuid(words: np.ndarray) -> str:
+    return str(uuid.UUID(bytes=np.ascontiguousarray(words, dtype=np.uint64).tobytes()))
+
+
+class ChunkStore:
+    """
+    Memory-mapped, append-only columnar store for chunk metadata.
+
+    Rows only hold compact references (vector ID, chunk/document UUIDs,
+    chunk index), plus optionally the vector itself in float16; the chunk
+    text is read from the database for the top-k hits (see chunk_text).
+    Filenames are kept per document in a tiny side table rather than per row.
+    """
+
+    def __init__(self, directory: str, generation: int = 0, dimension: int = DIMENSION):
+        self.directory = directory
+        self.generation = generation
+        self.dimension = dimension
+        self.filenames: Dict[str, str] = {}
+        self._columns: Dict[str, np.ndarray] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._nrows = 0
+
+        os.makedirs(directory, exist_ok=True)
+        docs_path = self._path("documents.jsonl")
+        if os.path.exists(docs_path):
+            with open(docs_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        row = json.loads(line)
+                        self.filenames[row["document_id"]] = row["filename"]
+        self._drop_legacy_text()
+        self._repair()
+        self._refresh()
+
+    def _drop_legacy_text(self):
+        for name in _LEGACY_FILES:
+            path = self._path(name)
+            if os.path.exists(path):
+                logger.info(f"Removing duplicated chunk text {path}")
+                os.remove(path)
+
+    def _repair(self):
+        """
+        Truncate columns to the number of rows whose ID was written, undoing
+        a partially completed append (e.g. after a crash), and cut the store
+        at the first ID that is not above the one before it.
+        """
+        ids_path = self._path("ids")
+        nrows = os.path.getsize(ids_path) // 8 if os.path.exists(ids_path) else 0
+        if nrows > 1:
+            ids = np.memmap(ids_path, dtype=np.int64, mode="r", shape=(nrows,))
+            bad = np.nonzero(np.diff(ids) <= 0)[0]
+            del ids
+            if len(bad):
+                logger.warning(f"Dropping {nrows - int(bad[0]) - 1} chunk rows with out-of-order IDs from {ids_path}")
+                nrows = int(bad[0]) + 1
+                os.truncate(ids_path, nrows * 8)
+        for name, (dtype, shape) in _COLUMNS.items():
+            path = self._path(name)
+            expected = nrows * np.dtype(dtype).itemsize * int(np.prod(shape))
+            if os.path.exists(path) and os.path.getsize(path) > expected:
+                os.truncate(path, expected)
+        path = self._path(_VECTORS)
+        expected = self._vector_nbytes(nrows)
+        if os.path.exists(path) and os.path.getsize(path) > expected:
+            os.truncate(path, expected)
+
+    def _vector_nbytes(self, nrows: int) -> int:
+        return nrows * self.dimension * np.dtype(_VECTOR_DTYPE).itemsize
+
+    def _path(self, column: str) -> str:
+        return os.path.join(self.directory, f"chunks-{self.generation:08d}.{column}")
+
+    def _refresh(self):
+        """
+        (Re)map the column files; called on open and after every append.
+        """
+        ids_path = self._path("ids")
+        nrows = os.path.getsize(ids_path) // 8 if os.path.exists(ids_path) else 0
+        self._nrows = nrows
+        for name, (dtype, shape) in _COLUMNS.items():
+            if nrows:
+                self._columns[name] = np.memmap(self._path(name), dtype=dtype, mode="r", shape=(nrows,) + shape)
+            else:
+                self._columns[name] = np.empty((0,) + shape, dtype=dtype)
+
+        path = self._path(_VECTORS)
+        self._vectors = None
+        if nrows and os.path.exists(path) and os.path.getsize(path) == self._vector_nbytes(nrows):
+            self._vectors = np.memmap(path, dtype=_VECTOR_DTYPE, mode="r", shape=(nrows, self.dimension))
+
+    def __len__(self) -> int:
+        return self._nrows
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._columns["ids"]
+
+    @property
+    def has_vectors(self) -> bool:
+        """
+        Whether every row has its vector stored (vacuously true when empty).
+        """
+        return self._vectors is not None or not self._nrows
+
+    def resident_nbytes(self) -> int:
+        """
+        Heap memory owned by the store; mapped pages belong to the page cache.
+        """
+        return sum(len(k) + len(v) for k, v in self.filenames.items()) + 64 * len(self.filenames)
+
+    def append(self, ids: np.ndarray, metadatas: List[Dict[str, Any]], vectors: Optional[np.ndarray] = None):
+        """
+        Append one row per (vector ID, metadata dict[, vector]). IDs must be
+        increasing. Any "text" in the metadata is not stored; vectors are
+        only kept if every earlier row has one too.
+        """
+        if not len(ids):
+            return
+
+        columns = {
+            "ids": np.asarray(ids, dtype=np.int64),
+            "chunk_ids": np.stack([_uuid_to_words(m["chunk_id"]) for m in metadatas]),
+            "doc_ids": np.stack([_uuid_to_words(m["document_id"]) for m in metadatas]),
+            "chunk_index": np.array([int(m.get("chunk_index", -1)) for m in metadatas], dtype=np.int32),
+        }
+        names = ["chunk_ids", "doc_ids", "chunk_index", "ids"]
+        if vectors is not None and self.has_vectors and np.shape(vectors)[1:] == (self.dimension,):
+            columns[_VECTORS] = np.asarray(vectors, dtype=_VECTOR_DTYPE)
+            names.insert(0, _VECTORS)
+        # IDs last: a crash mid-append leaves trailing bytes in the other
+        # columns, but no row is visible until its ID is written.
+        for name in names:
+            with open(self._path(name), "ab") as f:
+                f.write(np.ascontiguousarray(columns[name]).tobytes())
+
+        new_docs = {}
+        for m in metadatas:
+            doc_id = str(m["document_id"])
+            if doc_id not in self.filenames and doc_id not in new_docs:
+                new_docs[doc_id] = m.get("filename", "Unknown")
+        if new_docs:
+            with open(self._path("documents.jsonl"), "a", encoding="utf-8") as f:
+                for doc_id, filename in new_docs.items():
+                    f.write(json.dumps({"document_id": doc_id, "filename": filename}) + "\n")
+            self.filenames.update(new_docs)
+
+        self._refresh()
+
+    def truncate(self, next_id: int) -> int:
+        """
+        Drop trailing rows with IDs >= next_id: rows appended for vectors
+        whose segment was never written. Returns the number of rows dropped.
+        """
+        nrows = int(np.searchsorted(self.ids, next_id))
+        dropped = self._nrows - nrows
+        if not dropped:
+            return 0
+        # Unmap first; IDs are cut first so a crash midway is undone by _repair
+        self._columns, self._vectors = {}, None
+        for name in ["ids"] + [n for n in _COLUMNS if n != "ids"]:
+            dtype, shape = _COLUMNS[name]
+            os.truncate(self._path(name), nrows * np.dtype(dtype).itemsize * int(np.prod(shape)))
+        path = self._path(_VECTORS)
+        if os.path.exists(path) and os.path.getsize(path) > self._vector_nbytes(nrows):
+            os.truncate(path, self._vector_nbytes(nrows))
+        self._refresh()
+        return dropped
+
+    def _rows(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Row positions for the given vector IDs (-1 where absent).
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        col = self.ids
+        if not len(col):
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.searchsorted(col, ids)
+        pos_clipped = np.minimum(pos, len(col) - 1)
+        return np.where(col[pos_clipped] == ids, pos_clipped, -1)
+
+    def get(self, ids) -> List[Optional[Dict[str, Any]]]:
+        """
+        Metadata dicts (references only, no text) for the given vector IDs,
+        in order.
+        """
+        results: List[Optional[Dict[str, Any]]] = []
+        for row in self._rows(np.asarray(ids)).tolist():
+            if row < 0:
+                results.append(None)
+                continue
+            doc_id = _words_to_uuid(self._columns["doc_ids"][row])
+            results.append({
+                "chunk_id": _words_to_uuid(self._columns["chunk_ids"][row]),
+                "document_id": doc_id,
+                "chunk_index": int(self._columns["chunk_index"][row]),
+                "filename": self.filenames.get(doc_id, "Unknown"),
+            })
+        return results
+
+    def vectors(self, ids) -> Optional[np.ndarray]:
+        """
+        float32 vectors for the given vector IDs, in order; None if the store
+        holds no vectors or any ID is missing.
+        """
+        if self._vectors is None:
+            return None
+        rows = self._rows(np.asarray(ids))
+        if (rows < 0).any():
+            return None
+        return np.asarray(self._vectors[rows], dtype="float32")
+
+    def ids_for_document(self, document_id: Any) -> np.ndarray:
+        """
+        Vector IDs of every row belonging to a document (deleted rows included
+        until the next rewrite; callers filter against the live index).
+        """
+        words = _uuid_to_words(document_id)
+        col = self._columns["doc_ids"]
+        mask = (col[:, 0] == words[0]) & (col[:, 1] == words[1])
+        return np.asarray(self.ids[mask])
+
+    def rewrite(self, keep_ids: np.ndarray, generation: int, vectors: Optional[np.ndarray] = None) -> "ChunkStore":
+        """
+        Copy only the rows in `keep_ids` into a new generation and return it.
+        Used by compaction to drop rows of deleted documents. `vectors`
+        (aligned with the sorted `keep_ids`) backfill a store without them.
+        """
+        keep_ids = np.sort(np.asarray(keep_ids, dtype=np.int64))
+        rows = self._rows(keep_ids)
+        target = ChunkStore.__new__(ChunkStore)
+        target.directory = self.directory
+        target.generation = generation
+        target.dimension = self.dimension
+        target.filenames = {}
+
+        found = rows >= 0
+        columns = {name: np.asarray(self._columns[name][rows[found]]) for name in _COLUMNS}
+        names = ["chunk_ids", "doc_ids", "chunk_index", "ids"]
+        if self._vectors is not None:
+            columns[_VECTORS] = np.asarray(self._vectors[rows[found]])
+        elif vectors is not None:
+            columns[_VECTORS] = np.asarray(vectors, dtype=_VECTOR_DTYPE)[found]
+        if _VECTORS in columns:
+            names.insert(0, _VECTORS)
+        for name in names:
+            with open(target._path(name), "wb") as f:
+                f.write(np.ascontiguousarray(columns[name]).tobytes())
+
+        live_docs = {_words_to_uuid(w) for w in columns["doc_ids"]}
+        with open(target._path("documents.jsonl"), "w", encoding="utf-8") as f:
+            for doc_id in live_docs:
+                filename = self.filenames.get(doc_id, "Unknown")
+                f.write(json.dumps({"document_id": doc_id, "filename": filename}) + "\n")
+                target.filenames[doc_id] = filename
+
+        target._columns = {}
+        target._refresh()
+        return target
+
+    def delete_files(self):
+        for name in list(_COLUMNS) + [_VECTORS] + list(_LEGACY_FILES) + ["documents.jsonl"]:
+            path = self._path(name)
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,120 @@
+# app/services/chunk_text.py
+
+from __future__ import annotations
+
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List
+
+from app.core.config import get_settings
+from app.core.db import SessionLocal
+from app.models.document import DocumentChunk
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Bound parameters per SELECT ... IN (...)
+_LOOKUP_BATCH = 900
+
+
+class _ChunkTextCache:
+    """
+    Per-worker LRU of chunk_id -> text in front of document_chunks.
+
+    Chunk rows are never updated (re-ingesting creates new IDs), so entries
+    never go stale; a deleted chunk's entry just stops being asked for.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, chunk_ids: Iterable[str]) -> Dict[str, str]:
+        found = {}
+        with self._lock:
+            for chunk_id in chunk_ids:
+                text = self._entries.get(chunk_id)
+                if text is None:
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(chunk_id)
+                self.hits += 1
+                found[chunk_id] = text
+        return found
+
+    def put_many(self, texts: Dict[str, str]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for chunk_id, text in texts.items():
+                self._entries[chunk_id] = text
+                self._entries.move_to_end(chunk_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = _ChunkTextCache(settings.CHUNK_TEXT_CACHE_ENTRIES)
+
+
+def get_chunk_text_cache_stats() -> Dict[str, Any]:
+    return _cache.stats()
+
+
+def get_chunk_texts(chunk_ids: Iterable[str], use_cache: bool = True) -> Dict[str, str]:
+    """
+    chunk_id -> text for the given DocumentChunk IDs (missing IDs are left
+    out). Served from the hot cache where possible, the rest with one
+    batched SELECT. `use_cache=False` is for bulk reads (e.g. rebuilding an
+    index) that shouldn't evict the hot set.
+    """
+    wanted = list(dict.fromkeys(str(c) for c in chunk_ids))
+    found = _cache.get_many(wanted) if use_cache else {}
+    missing = [c for c in wanted if c not in found]
+    if not missing:
+        return found
+
+    fetched: Dict[str, str] = {}
+    db = SessionLocal()
+    try:
+        for start in range(0, len(missing), _LOOKUP_BATCH):
+            batch = [uuid.UUID(c) for c in missing[start:start + _LOOKUP_BATCH]]
+            rows = (
+                db.query(DocumentChunk.id, DocumentChunk.text)
+                .filter(DocumentChunk.id.in_(batch))
+                .all()
+            )
+            fetched.update((str(chunk_id), text) for chunk_id, text in rows)
+    finally:
+        db.close()
+
+    if use_cache:
+        _cache.put_many(fetched)
+    found.update(fetched)
+    return found
+
+
+def hydrate(metadatas: List[Dict[str, Any]], use_cache: bool = True) -> None:
+    """
+    Fill in "text" on chunk metadata dicts (as returned by the FAISS store),
+    all in one lookup. Chunks no longer in the database get "".
+    """
+    texts = get_chunk_texts((m["chunk_id"] for m in metadatas if "text" not in m), use_cache=use_cache)
+    for m in metadatas:
+        if "text" not in m:
+            m["text"] = texts.get(m["chunk_id"], "")
@@ -0,0 +1,143 @@
+# app/services/context_packing.py
+
+from __future__ import annotations
+
+import logging
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# A retrieved chunk: {"text": str, "chunk_id": str, "document_id": str, "chunk_index": int}.
+# chunk_index -1 means the position is unknown (rows migrated from old
+# indexes). Plain strings are accepted too; they are packed but never merged.
+ContextChunk = Dict[str, Any]
+
+# Chunks overlap by 200 chars (ingestion); allow for whitespace the chunker strips
+MAX_OVERLAP_CHARS = 256
+MIN_OVERLAP_CHARS = 16
+
+# Per-snippet header ("[Snippet N]\n" plus separator), in tokens
+SNIPPET_OVERHEAD_TOKENS = 8
+
+
+@lru_cache(maxsize=1)
+def _get_token_counter() -> Callable[[str], int]:
+    """
+    Token counter for budgeting: the HF tokenizer at CONTEXT_TOKENIZER_PATH
+    (e.g. the serving model's tokenizer.json) if set, otherwise an estimate
+    of ~CONTEXT_CHARS_PER_TOKEN characters per token.
+    """
+    path = settings.CONTEXT_TOKENIZER_PATH
+    if path:
+        try:
+            from tokenizers import Tokenizer
+
+            tokenizer = Tokenizer.from_file(path)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        except Exception as e:
+            logger.warning(f"Could not load tokenizer {path}, estimating token counts: {e}")
+
+    chars_per_token = max(settings.CONTEXT_CHARS_PER_TOKEN, 1.0)
+    return lambda text: int(len(text) / chars_per_token) + 1
+
+
+def count_tokens(text: str) -> int:
+    return _get_token_counter()(text)
+
+
+def _overlap(left: str, right: str) -> int:
+    """
+    Length of the longest suffix of `left` that is also a prefix of `right`
+    (0 if shorter than MIN_OVERLAP_CHARS, i.e. probably a coincidence).
+    """
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _key(chunk: ContextChunk) -> Optional[Tuple[str, int]]:
+    if chunk.get("document_id") is None or chunk.get("chunk_index") is None or int(chunk["chunk_index"]) < 0:
+        return None
+    return str(chunk["document_id"]), int(chunk["chunk_index"])
+
+
+def pack_context(
+    context_chunks: Sequence[Union[str, ContextChunk]],
+    token_budget: Optional[int] = None,
+) -> List[str]:
+    """
+    Turn ranked chunks into the snippets to put in the prompt.
+
+    Chunks are taken in rank order while they fit `token_budget`. A chunk
+    next to one already taken (same document, adjacent chunk_index) is
+    joined onto it, minus the text the two share, so overlapping windows
+    become one continuous snippet and the overlap is paid for only once.
+    Snippets come out in the rank of their best chunk. The top chunk is
+    always kept, even if alone it exceeds the budget.
+    """
+    chunks = [{"text": c} if isinstance(c, str) else c for c in context_chunks]
+    chunks = [c for c in chunks if c.get("text")]
+
+    taken: Dict[Tuple[str, int], ContextChunk] = {}
+    order: List[Tuple[ContextChunk, Optional[Tuple[str, int]]]] = []  # taken chunks (and keys) in rank order
+    seen_ids = set()
+    used = 0
+    for chunk in chunks:
+        chunk_id = chunk.get("chunk_id")
+        if chunk_id is not None:
+            if chunk_id in seen_ids:
+                continue  # same chunk retrieved twice
+            seen_ids.add(chunk_id)
+        key = _key(chunk)
+        if key is not None and key in taken:
+            if chunk_id is None:
+                continue  # no ID to tell them apart: assume the same chunk
+            key = None  # a different chunk at the same position: keep it, unmerged
+
+        text = chunk["text"]
+        cost = SNIPPET_OVERHEAD_TOKENS
+        if key is not None:
+            doc_id, index = key
+            before, after = taken.get((doc_id, index - 1)), taken.get((doc_id, index + 1))
+            start = _overlap(before["text"], text) if before else 0
+            end = len(text) - (_overlap(text, after["text"]) if after else 0)
+            text = text[start:max(start, end)]
+            if before or after:
+                cost = 0  # extends an existing snippet
+        cost += count_tokens(text) if text else 0
+
+        if token_budget is not None and order and used + cost > token_budget:
+            continue
+        used += cost
+        order.append((chunk, key))
+        if key is not None:
+            taken[key] = chunk
+
+    # Join runs of adjacent chunks into single snippets
+    snippets: List[str] = []
+    placed = set()
+    for chunk, key in order:
+        if key is None:
+            snippets.append(chunk["text"])
+            continue
+        if key in placed:
+            continue
+        doc_id, index = key
+        while (doc_id, index - 1) in taken:
+            index -= 1
+        text = ""
+        while (doc_id, index) in taken:
+            piece = taken[(doc_id, index)]["text"]
+            text += piece[_overlap(text, piece):] if text else piece
+            placed.add((doc_id, index))
+            index += 1
+        snippets.append(text)
+
+    if token_budget is not None:
+        logger.debug(f"Packed {len(order)}/{len(chunks)} chunks into {len(snippets)} snippets, ~{used} tokens")
+    return snippets
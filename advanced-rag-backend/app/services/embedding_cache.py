@@ -0,0 +1,225 @@
+# app/services/embedding_cache.py
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "..", "data", "embedding_cache.sqlite3"
+)
+
+# SQLite's default limit on bound parameters is 999
+_LOOKUP_BATCH = 900
+# A row's last_used is only rewritten once it is this stale, so hits rarely write
+_TOUCH_SECONDS = 3600
+# Rows inserted (by this process) between checks of the file's size
+_PRUNE_EVERY = 1000
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent (model, sha256(text)) -> vector cache.
+
+    Vectors are stored as float16 blobs in a small SQLite file, so every
+    worker process on the node shares one copy safely; the most recently used
+    ones are also kept in an in-memory LRU (also float16) in front of it.
+    With `max_rows`, the least recently used rows beyond it are pruned as
+    new ones are written.
+    """
+
+    def __init__(self, path: str, hot_entries: int = 20_000, max_rows: int = 0):
+        self.path = path
+        self.hot_entries = hot_entries
+        self.max_rows = max_rows
+        self._unchecked = 0
+        self._hot: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hot_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.pruned = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL,"
+                " digest BLOB NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " last_used INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (model, digest)"
+                ") WITHOUT ROWID"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(embeddings)")}
+            if "last_used" not in columns:
+                # Files from before pruning: existing rows count as least recently used
+                conn.execute("ALTER TABLE embeddings ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _hot_key(self, model: str, digest: bytes) -> bytes:
+        return model.encode("utf-8") + b"\0" + digest
+
+    def get_many(self, model: str, digests: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        """
+        Cached vectors (float16) for the given digests, None where missing.
+        """
+        results: List[Optional[np.ndarray]] = [None] * len(digests)
+        missing: Dict[bytes, List[int]] = {}
+        with self._lock:
+            for i, digest in enumerate(digests):
+                key = self._hot_key(model, digest)
+                vector = self._hot.get(key)
+                if vector is not None:
+                    self._hot.move_to_end(key)
+                    self.hot_hits += 1
+                    results[i] = vector
+                else:
+                    missing.setdefault(digest, []).append(i)
+
+        if not missing:
+            return results
+
+        found: Dict[bytes, np.ndarray] = {}
+        pending = list(missing)
+        try:
+            conn = self._connect()
+            for start in range(0, len(pending), _LOOKUP_BATCH):
+                batch = pending[start:start + _LOOKUP_BATCH]
+                rows = conn.execute(
+                    "SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN (%s)"
+                    % ",".join("?" * len(batch)),
+                    [model, *batch],
+                ).fetchall()
+                for digest, blob in rows:
+                    found[bytes(digest)] = np.frombuffer(blob, dtype=np.float16)
+            if found:
+                self._touch(conn, model, list(found))
+        except sqlite3.Error as e:
+            logger.warning("Embedding cache lookup failed: %s", e)
+
+        with self._lock:
+            for digest, positions in missing.items():
+                vector = found.get(digest)
+                if vector is None:
+                    self.misses += len(positions)
+                    continue
+                self.disk_hits += len(positions)
+                self._remember(self._hot_key(model, digest), vector)
+                for i in positions:
+                    results[i] = vector
+        return results
+
+    def _touch(self, conn: sqlite3.Connection, model: str, digests: List[bytes]) -> None:
+        now = int(time.time())
+        with conn:
+            for start in range(0, len(digests), _LOOKUP_BATCH):
+                batch = digests[start:start + _LOOKUP_BATCH]
+                conn.execute(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND last_used < ? AND digest IN (%s)"
+                    % ",".join("?" * len(batch)),
+                    [now, model, now - _TOUCH_SECONDS, *batch],
+                )
+
+    def put_many(self, model: str, digests: Sequence[bytes], vectors: np.ndarray) -> None:
+        vectors16 = np.asarray(vectors, dtype=np.float16)
+        now = int(time.time())
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (model, digest, vector, last_used) VALUES (?, ?, ?, ?)",
+                    [(model, digest, vector.tobytes(), now) for digest, vector in zip(digests, vectors16)],
+                )
+            self._unchecked += len(digests)
+            if self.max_rows > 0 and self._unchecked >= min(_PRUNE_EVERY, self.max_rows):
+                self._unchecked = 0
+                self._prune(conn)
+        except sqlite3.Error as e:
+            logger.warning("Embedding cache write failed: %s", e)
+
+        with self._lock:
+            for digest, vector in zip(digests, vectors16):
+                self._remember(self._hot_key(model, digest), vector)
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        """
+        Delete the least recently used rows beyond `max_rows`.
+        """
+        (rows,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = rows - self.max_rows
+        if excess <= 0:
+            return
+        with conn:
+            conn.execute(
+                "DELETE FROM embeddings WHERE (model, digest) IN"
+                " (SELECT model, digest FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+        self.pruned += excess
+        logger.info("Pruned %d least recently used rows from the embedding cache", excess)
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        if self.hot_entries <= 0:
+            return
+        self._hot[key] = vector
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_entries:
+            self._hot.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hot_hits + self.disk_hits + self.misses
+            return {
+                "hot_entries": len(self._hot),
+                "max_hot_entries": self.hot_entries,
+                "hot_hits": self.hot_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "max_rows": self.max_rows,
+                "pruned": self.pruned,
+                "hit_rate": (self.hot_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(
+                settings.EMBED_CACHE_PATH or DEFAULT_CACHE_PATH,
+                hot_entries=settings.EMBED_CACHE_HOT_ENTRIES,
+                max_rows=settings.EMBED_CACHE_MAX_ROWS,
+            )
+        return _cache
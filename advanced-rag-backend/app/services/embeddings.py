@@ -1,9 +1,19 @@
+import re
+import threading
+from collections import OrderedDict
 from functools import lru_cache
-from typing import List
+from typing import Any, Dict, List, Optional
 
 import numpy as np
 from fastembed import TextEmbedding
 
+from app.core.config import get_settings
+from app.services.embedding_cache import get_embedding_cache, text_digest
+
+settings = get_settings()
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
 @lru_cache(maxsize=1)
 def get_embedding_model() -> TextEmbedding:
     """
@@ -12,37 +22,172 @@ def get_embedding_model() -> TextEmbedding:
     It downloads a small, optimized version of the model (~200MB) automatically.
     """
     # This model name matches the performance of "all-MiniLM-L6-v2"
-    return TextEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    return TextEmbedding(model_name=EMBEDDING_MODEL)
+
+
+def _embed_uncached(texts: List[str]) -> np.ndarray:
+    model = get_embedding_model()
+    
+    # model.embed(texts) returns a Python generator. 
+    # We convert it to a list, then to a numpy array.
+    vectors = list(model.embed(texts))
+    
+    return np.array(vectors, dtype="float32")
 
 
-def embed_texts(texts: List[str]) -> np.ndarray:
+def embed_texts(texts: List[str], use_cache: bool = True) -> np.ndarray:
     """
     Embed a list of texts -> shape (n, dim) float32 numpy array.
     Used when indexing document chunks.
+
+    Texts already seen (by content hash) are served from the embedding cache;
+    only the rest, deduplicated, go through the model.
     """
     if not texts:
         # 384 is the dimension for all-MiniLM-L6-v2
         return np.zeros((0, 384), dtype="float32")
 
-    model = get_embedding_model()
-    
-    # model.embed(texts) returns a Python generator. 
-    # We convert it to a list, then to a numpy array.
-    vectors = list(model.embed(texts))
-    
-    return np.array(vectors, dtype="float32")
+    if not (use_cache and settings.EMBED_CACHE_ENABLED):
+        return _embed_uncached(texts)
+
+    cache = get_embedding_cache()
+    digests = [text_digest(t) for t in texts]
+    cached = cache.get_many(EMBEDDING_MODEL, digests)
+
+    # Unique texts that still need a forward pass
+    todo: Dict[bytes, str] = {}
+    for digest, text, vector in zip(digests, texts, cached):
+        if vector is None and digest not in todo:
+            todo[digest] = text
+
+    fresh: Dict[bytes, np.ndarray] = {}
+    if todo:
+        vectors = _embed_uncached(list(todo.values()))
+        cache.put_many(EMBEDDING_MODEL, list(todo), vectors)
+        fresh = dict(zip(todo, vectors))
 
+    return np.stack([
+        fresh[digest] if vector is None else vector.astype("float32")
+        for digest, vector in zip(digests, cached)
+    ]).astype("float32", copy=False)
 
-def embed_query(text: str) -> np.ndarray:
+
+class _QueryCache:
     """
-    Embed a single query string -> shape (dim,) float32 numpy array.
-    Used at retrieval time.
+    Size-bounded in-process LRU of query vectors, keyed on (model, normalized
+    query text), with hit/miss counters.
     """
-    if not text:
-        return np.zeros((384,), dtype="float32")
 
-    # Reuse the function above
-    vectors = embed_texts([text])
-    
-    # Return the first (and only) vector, flattened
-    return vectors[0]
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return vector
+
+    def record(self, outcome: str) -> None:
+        """
+        Count a lookup that missed this tier: "shared" (found in the shared
+        tier) or "miss" (embedded by the model).
+        """
+        with self._lock:
+            if outcome == "shared":
+                self.shared_hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+
+_query_cache = _QueryCache(settings.QUERY_CACHE_MAX_ENTRIES)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    # The model's tokenizer is uncased and splits on whitespace, so case and
+    # spacing differences produce the same vector.
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def get_query_cache_stats() -> Dict[str, Any]:
+    return _query_cache.stats()
+
+
+def embed_queries(texts: List[str]) -> np.ndarray:
+    """
+    Embed several query strings -> shape (n, dim) float32 numpy array.
+
+    Each query is looked up in the query-vector cache (and the shared tier
+    if enabled); all misses go through the model in a single call.
+    """
+    vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+    shared_model = f"{EMBEDDING_MODEL}#query"
+
+    misses: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        if not text:
+            vectors[i] = np.zeros((384,), dtype="float32")
+            continue
+        normalized = normalize_query(text)
+        vector = _query_cache.get(f"{EMBEDDING_MODEL}\0{normalized}")
+        if vector is not None:
+            vectors[i] = vector.copy()
+        else:
+            misses.setdefault(normalized, []).append(i)
+
+    if misses and settings.QUERY_CACHE_SHARED:
+        pending = list(misses)
+        shared = get_embedding_cache().get_many(shared_model, [text_digest(q) for q in pending])
+        for normalized, vector in zip(pending, shared):
+            if vector is None:
+                continue
+            vector = vector.astype("float32")
+            _query_cache.record("shared")
+            _query_cache.put(f"{EMBEDDING_MODEL}\0{normalized}", vector)
+            for i in misses.pop(normalized):
+                vectors[i] = vector.copy()
+
+    if misses:
+        pending = list(misses)
+        for _ in pending:
+            _query_cache.record("miss")
+        fresh = _embed_uncached(pending)
+        for normalized, vector in zip(pending, fresh):
+            _query_cache.put(f"{EMBEDDING_MODEL}\0{normalized}", vector)
+            for i in misses[normalized]:
+                vectors[i] = vector.copy()
+        if settings.QUERY_CACHE_SHARED:
+            get_embedding_cache().put_many(shared_model, [text_digest(q) for q in pending], fresh)
+
+    if not vectors:
+        return np.zeros((0, 384), dtype="float32")
+    return np.stack(vectors)
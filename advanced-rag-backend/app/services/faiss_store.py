@@ -1,145 +1,1138 @@
+import io
 import os
+import json
 import pickle
+import shutil
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import faiss
 import numpy as np
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+from app.core.config import get_settings
+from app.services.chunk_store import ChunkStore
+from app.services.chunk_text import hydrate
+from app.services.lexical_index import LexicalIndex, LexicalSegment
+from app.services.index_factory import (
+    build_index,
+    desired_kind,
+    desired_metric,
+    index_kind,
+    index_metric,
+    index_nbytes,
+    is_lossy,
+    new_index,
+    normalized,
+    search_params,
+    supports_remove,
+    supports_selector,
+    tune_index,
+)
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 # Directory where FAISS indices are saved
 INDICES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "data", "indices")
 os.makedirs(INDICES_DIR, exist_ok=True)
 
-# Global in-memory cache for indices and metadata
-# Format: { user_id_str: { "index": faiss_index, "metadata": [dict, dict, ...] } }
-indices: Dict[str, Dict[str, Any]] = {}
 
-def _get_user_index_path(user_id: str) -> str:
+class _IndexCache:
+    """
+    Memory-bounded cache of loaded user indices.
+
+    Entries are evicted (LRU or LFU) once the summed size of resident indices
+    plus their chunk stores exceeds `max_bytes`. Everything in here is already
+    persisted by save_user_index, so an evicted user is simply reloaded from
+    disk on their next query.
+    """
+
+    def __init__(self, max_bytes: int, policy: str = "lru"):
+        self.max_bytes = max_bytes
+        self.policy = policy.lower()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._uses: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def peek(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Lookup without touching recency or hit/miss counters.
+        """
+        with self._lock:
+            return self._entries.get(user_id)
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(user_id)
+            self._uses[user_id] += 1
+            return entry
+
+    def put(self, user_id: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self.pop(user_id)
+            self._entries[user_id] = entry
+            self._uses[user_id] = 1
+            self._sizes[user_id] = 0
+            self.loads += 1
+            self.resize(user_id)
+
+    def resize(self, user_id: str) -> None:
+        """
+        Re-measure an entry after it changed and evict others if over budget.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            size = _entry_nbytes(entry)
+            self.total_bytes += size - self._sizes[user_id]
+            self._sizes[user_id] = size
+            self._evict(keep=user_id)
+
+    def pop(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self.total_bytes -= self._sizes.pop(user_id)
+                self._uses.pop(user_id)
+            return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._uses.clear()
+            self.total_bytes = 0
+
+    def _evict(self, keep: str) -> None:
+        # Never evict the entry that was just touched, even if it alone is
+        # larger than the budget; it will go once something else is loaded.
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            candidates = [uid for uid in self._entries if uid != keep]
+            if self.policy == "lfu":
+                # OrderedDict order breaks LFU ties by recency
+                victim = min(candidates, key=lambda uid: self._uses[uid])
+            else:
+                victim = candidates[0]
+            self.pop(victim)
+            self.evictions += 1
+            logger.info(f"Evicted index for user {victim} from memory cache")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "policy": self.policy,
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+def _entry_nbytes(entry: Dict[str, Any]) -> int:
+    # Chunk metadata is memory-mapped, so only the indexes themselves are resident
+    return (
+        index_nbytes(entry["index"])
+        + entry["lexical"].nbytes
+        + entry["store"].resident_nbytes()
+        + 16 * len(entry["deleted"])
+    )
+
+
+# Global in-memory cache for indices and their chunk stores
+# Format: { user_id_str: { "index": faiss_index, "lexical": LexicalIndex (BM25), "store": ChunkStore, "next_id": int,
+#                          "seq": last applied segment, "base_seq": segment of the base snapshot,
+#                          "deleted": tombstoned IDs (ANN kinds), "id_map": cached internal->ID array } }
+# Vector IDs are stable int64s assigned at insert time, so a single document's
+# vectors can be removed without renumbering (or re-embedding) everything else.
+indices = _IndexCache(
+    max_bytes=settings.FAISS_CACHE_MAX_BYTES,
+    policy=settings.FAISS_CACHE_POLICY,
+)
+
+# Per-user locks so a load/modify/save sequence is never interleaved with an
+# eviction + reload of the same user (which would lose the update). Weakly
+# held: a lock only exists while someone holds or waits for it, so the maps
+# don't grow with every user ever seen.
+_user_locks: "weakref.WeakValueDictionary[str, threading.RLock]" = weakref.WeakValueDictionary()
+_user_locks_guard = threading.Lock()
+
+
+def _user_lock(user_id: str) -> threading.RLock:
+    with _user_locks_guard:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = threading.RLock()
+        return lock
+
+
+class _ReadWriteLock:
+    """
+    Any number of concurrent readers, or one writer. Waiting writers go
+    first, so a steady stream of searches cannot starve an upload.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+# Searches read a user's index, chunk store and lexical index while holding
+# the read side; anything changing those in place on a cached entry holds the
+# write side (always inside _user_lock, and only for the mutation itself).
+_search_locks: "weakref.WeakValueDictionary[str, _ReadWriteLock]" = weakref.WeakValueDictionary()
+
+
+def _search_lock(user_id: str) -> _ReadWriteLock:
+    with _user_locks_guard:
+        lock = _search_locks.get(user_id)
+        if lock is None:
+            lock = _search_locks[user_id] = _ReadWriteLock()
+        return lock
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """
+    Hit/miss/load/eviction counters and current residency of the index cache.
+    """
+    return indices.stats()
+
+# ------------------------------
+# On-disk layout (per user directory)
+#
+#   manifest.json          {"format": 2, "base_seq": N, "next_id": M, "chunk_gen": G, "deleted": [...],
+#                           "recall": recall@10 of the base index vs exact search, if measured}
+#   base-<N>.index         FAISS snapshot (flat/HNSW/IVF/IVF-PQ, L2 or inner product)
+#                          up to and including segment N
+#   lex-<N>.npz            BM25 inverted index snapshot matching base-<N>
+#   chunks-<G>.*           columnar chunk metadata (see chunk_store.py), append-only,
+#                          with a float16 copy of the vectors for exact re-scoring
+#   seg-<K>.npz            one append-only segment per upload/delete, K > N (adds carry
+#                          their vectors and the BM25 postings of their chunks)
+#
+# Uploads and deletes only write their own segment (plus appended chunk rows);
+# segments are folded into a new base snapshot by a background compaction,
+# which also rebuilds the index when its size tier (FAISS_INDEX_TIERS) or
+# metric (FAISS_METRIC) changes, or tombstones (deletes on ANN indexes) need purging.
+# ------------------------------
+
+LAYOUT_FORMAT = 2
+
+# Segments beyond the base snapshot before a background compaction is scheduled
+COMPACT_AFTER_SEGMENTS = settings.FAISS_COMPACT_SEGMENTS
+
+# Compactions and index rebuilds share one worker, so a rebuild never races
+# with a compaction deleting the segments it needs to catch up on.
+_compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="faiss-compact")
+_compacting: Set[str] = set()
+_compacting_guard = threading.Lock()
+
+def _get_user_dir(user_id: str) -> str:
+    return os.path.join(INDICES_DIR, user_id)
+
+def _get_manifest_path(user_id: str) -> str:
+    return os.path.join(_get_user_dir(user_id), "manifest.json")
+
+def _get_base_index_path(user_id: str, seq: int) -> str:
+    return os.path.join(_get_user_dir(user_id), f"base-{seq:08d}.index")
+
+def _get_lexical_path(user_id: str, seq: int) -> str:
+    return os.path.join(_get_user_dir(user_id), f"lex-{seq:08d}.npz")
+
+def _get_segment_path(user_id: str, seq: int) -> str:
+    return os.path.join(_get_user_dir(user_id), f"seg-{seq:08d}.npz")
+
+def _get_legacy_index_path(user_id: str) -> str:
     return os.path.join(INDICES_DIR, f"{user_id}.index")
 
-def _get_user_metadata_path(user_id: str) -> str:
+def _get_legacy_metadata_path(user_id: str) -> str:
     return os.path.join(INDICES_DIR, f"{user_id}.pkl")
 
-def load_user_index(user_id: str):
+def _get_version_path(user_id: str) -> str:
+    # Outside the user's directory, so wiping the index doesn't reset it
+    return os.path.join(INDICES_DIR, f"{user_id}.version")
+
+def _atomic_write(path: str, data: bytes):
     """
-    Load user's FAISS index and metadata from disk if not already in memory.
+    Write to a temp file and rename, so readers never see a half-written file.
     """
-    user_id = str(user_id)
-    if user_id in indices:
-        return indices[user_id]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _list_segments(user_id: str, suffix: str = ".npz") -> List[int]:
+    user_dir = _get_user_dir(user_id)
+    if not os.path.isdir(user_dir):
+        return []
+    seqs = []
+    for name in os.listdir(user_dir):
+        if name.startswith("seg-") and name.endswith(suffix):
+            seqs.append(int(name[4:-len(suffix)]))
+    return sorted(seqs)
+
+def _new_entry(store: ChunkStore, index=None, next_id: int = 0, seq: int = 0) -> Dict[str, Any]:
+    return {
+        "index": index if index is not None else new_index(),
+        "lexical": LexicalIndex(),
+        "store": store,
+        "next_id": next_id,
+        "seq": seq,
+        "base_seq": seq,
+        "deleted": set(),
+        "id_map": None,
+        "recall": None,
+    }
 
-    index_path = _get_user_index_path(user_id)
-    meta_path = _get_user_metadata_path(user_id)
+def _id_map(user_data: Dict[str, Any]) -> np.ndarray:
+    """
+    Internal position -> vector ID array, cached until the index changes.
+    """
+    id_map = user_data["id_map"]
+    if id_map is None:
+        id_map = user_data["id_map"] = faiss.vector_to_array(user_data["index"].id_map).astype("int64")
+    return id_map
+
+def _live_ids(user_data: Dict[str, Any]) -> np.ndarray:
+    ids = np.sort(_id_map(user_data))
+    if user_data["deleted"]:
+        ids = ids[~np.isin(ids, np.fromiter(user_data["deleted"], dtype="int64"))]
+    return ids
+
+def _migrate_legacy(index, metadata: List[Dict[str, Any]]):
+    """
+    Convert an old positional index (plain IndexFlatL2 + metadata list) into
+    an ID-mapped one. Vector i keeps ID i, so no re-embedding is needed.
+    """
+    ntotal = index.ntotal
+    vectors = index.reconstruct_n(0, ntotal) if ntotal else np.zeros((0, index.d), dtype="float32")
+    migrated = build_index("flat", vectors, np.arange(ntotal, dtype="int64"), dimension=index.d)
+    return migrated, {i: meta for i, meta in enumerate(metadata[:ntotal])}
 
+def _load_pickled(user_id: str) -> Optional[Tuple[Any, Dict[int, Dict[str, Any]], int]]:
+    """
+    Read either of the older pickled-metadata layouts, for one-off migration:
+    a root `<user_id>.index` + `<user_id>.pkl` pair, or a per-user directory
+    whose base snapshot and segments still carry pickled metadata.
+    """
+    index_path = _get_legacy_index_path(user_id)
+    meta_path = _get_legacy_metadata_path(user_id)
     if os.path.exists(index_path) and os.path.exists(meta_path):
-        logger.info(f"Loading existing index for user {user_id}")
         index = faiss.read_index(index_path)
         with open(meta_path, "rb") as f:
+            stored = pickle.load(f)
+        if isinstance(stored, list):
+            index, metadata = _migrate_legacy(index, stored)
+            return index, metadata, len(metadata)
+        return index, stored["metadata"], stored["next_id"]
+
+    manifest_path = _get_manifest_path(user_id)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("format") == LAYOUT_FORMAT:
+        return None
+
+    base_seq = manifest["base_seq"]
+    index, metadata, next_id = new_index(), {}, manifest["next_id"]
+    base_path = os.path.join(_get_user_dir(user_id), f"base-{base_seq:08d}")
+    if os.path.exists(f"{base_path}.index"):
+        index = faiss.read_index(f"{base_path}.index")
+        with open(f"{base_path}.pkl", "rb") as f:
             metadata = pickle.load(f)
-        indices[user_id] = {"index": index, "metadata": metadata}
+    for seq in _list_segments(user_id, suffix=".pkl"):
+        if seq <= base_seq:
+            continue
+        with open(os.path.join(_get_user_dir(user_id), f"seg-{seq:08d}.pkl"), "rb") as f:
+            segment = pickle.load(f)
+        if segment["op"] == "add":
+            vectors = segment["vectors"]
+            index.add_with_ids(normalized(vectors) if index_metric(index) == "ip" else vectors, segment["ids"])
+            metadata.update(zip(segment["ids"].tolist(), segment["metadata"]))
+            next_id = max(next_id, int(segment["ids"].max()) + 1)
+        else:
+            index.remove_ids(segment["ids"])
+            for vector_id in segment["ids"].tolist():
+                metadata.pop(vector_id, None)
+    return index, metadata, next_id
+
+def _migrate_pickled(user_id: str) -> Optional[Dict[str, Any]]:
+    loaded = _load_pickled(user_id)
+    if loaded is None:
+        return None
+    index, metadata, next_id = loaded
+    logger.info(f"Migrating pickled index metadata for user {user_id} to the chunk store")
+
+    user_dir = _get_user_dir(user_id)
+    os.makedirs(user_dir, exist_ok=True)
+    for name in os.listdir(user_dir):
+        # Leftovers of the pickled layout; the snapshot below replaces them
+        if name.endswith(".pkl") or name.endswith(".index") or name == "manifest.json":
+            os.remove(os.path.join(user_dir, name))
+
+    store = ChunkStore(user_dir, generation=0)
+    user_data = _new_entry(store, index=index, next_id=next_id)
+    ids = _live_ids(user_data)
+    store.append(ids, [metadata[i] for i in ids.tolist()])
+    user_data["lexical"].add(LexicalSegment.build(ids.tolist(), [metadata[i].get("text", "") for i in ids.tolist()]))
+    save_user_index(user_id, user_data)
+
+    for path in (_get_legacy_index_path(user_id), _get_legacy_metadata_path(user_id)):
+        if os.path.exists(path):
+            os.remove(path)
+    return user_data
+
+def _lexical_for_ids(store: ChunkStore, ids: np.ndarray) -> LexicalSegment:
+    """
+    BM25 postings for chunks already in the store (segments and snapshots
+    written before the lexical index existed), with text from the database.
+    """
+    metadatas = store.get(ids)
+    hydrate([meta for meta in metadatas if meta is not None], use_cache=False)
+    texts = [(meta or {}).get("text", "") for meta in metadatas]
+    return LexicalSegment.build(np.asarray(ids).tolist(), texts)
+
+def _apply_segment(user_data: Dict[str, Any], segment: Dict[str, np.ndarray], lexical: bool = True):
+    ids = segment["ids"]
+    if str(segment["op"]) == "add":
+        vectors = segment["vectors"]
+        if index_metric(user_data["index"]) == "ip":
+            # segments written before the switch to inner product hold raw vectors
+            vectors = normalized(vectors)
+        user_data["index"].add_with_ids(vectors, ids)
+        if len(ids):
+            user_data["next_id"] = max(user_data["next_id"], int(ids.max()) + 1)
+        if lexical:
+            if "lex_terms" in segment:
+                user_data["lexical"].add(LexicalSegment.from_arrays(segment, prefix="lex_"))
+            else:
+                user_data["lexical"].add(_lexical_for_ids(user_data["store"], ids))
     else:
-        logger.info(f"Creating new index for user {user_id}")
-        # Dimension 384 for standard embeddings (e.g., all-MiniLM-L6-v2)
-        # Adjust if using a different model dimension
-        dimension = 384  
-        index = faiss.IndexFlatL2(dimension)
-        indices[user_id] = {"index": index, "metadata": []}
-    
-    return indices[user_id]
+        if supports_remove(user_data["index"]):
+            user_data["index"].remove_ids(ids)
+        else:
+            user_data["deleted"].update(ids.tolist())
+        if lexical:
+            user_data["lexical"].delete(ids.tolist())
+    user_data["id_map"] = None
+
+def _append_segment(user_id: str, user_data: Dict[str, Any], segment: Dict[str, np.ndarray]):
+    """
+    Persist one upload/delete as its own segment file (no full rewrite).
+    Callers write the segment before applying it in memory, so a failed
+    write leaves the in-memory index matching what is on disk.
+    """
+    seq = user_data["seq"] + 1
+    buffer = io.BytesIO()
+    np.savez(buffer, **segment)
+    _atomic_write(_get_segment_path(user_id, seq), buffer.getvalue())
+    user_data["seq"] = seq
+
+def _needs_compaction(user_data: Dict[str, Any]) -> bool:
+    index = user_data["index"]
+    return (
+        user_data["seq"] - user_data["base_seq"] >= COMPACT_AFTER_SEGMENTS
+        or index_kind(index) != desired_kind(index.ntotal - len(user_data["deleted"]))
+        or index_metric(index) != desired_metric()
+        # Purge tombstones once they are a noticeable share of the graph
+        or len(user_data["deleted"]) > max(1000, index.ntotal // 10)
+    )
+
+def load_user_index(user_id: str):
+    """
+    Load user's FAISS index from disk if not already in memory: the latest
+    base snapshot, then every segment written after it. Chunk metadata is
+    only memory-mapped here, never read in full.
+    """
+    user_id = str(user_id)
+    cached = indices.get(user_id)
+    if cached is not None:
+        return cached
+
+    with _user_lock(user_id):
+        # Another thread may have loaded it while we waited for the lock
+        cached = indices.peek(user_id)
+        if cached is not None:
+            return cached
+
+        user_data = _migrate_pickled(user_id)
+        manifest_path = _get_manifest_path(user_id)
+        if user_data is None:
+            if os.path.exists(manifest_path):
+                logger.info(f"Loading existing index for user {user_id}")
+                with open(manifest_path, "r") as f:
+                    manifest = json.load(f)
+            else:
+                # No snapshot yet (written only by the first compaction), but
+                # there may already be segments to replay onto an empty base
+                logger.info(f"Creating new index for user {user_id}")
+                manifest = {"base_seq": 0, "next_id": 0, "chunk_gen": 0}
+            base_seq = manifest["base_seq"]
+            user_data = _new_entry(
+                ChunkStore(_get_user_dir(user_id), generation=manifest["chunk_gen"]),
+                next_id=manifest["next_id"],
+                seq=base_seq,
+            )
+            user_data["deleted"].update(manifest.get("deleted", []))
+            user_data["recall"] = manifest.get("recall")
+            index_path = _get_base_index_path(user_id, base_seq)
+            if os.path.exists(index_path):
+                user_data["index"] = faiss.read_index(index_path)
+                tune_index(user_data["index"])
+
+            lexical_path = _get_lexical_path(user_id, base_seq)
+            if os.path.exists(lexical_path):
+                with np.load(lexical_path, allow_pickle=False) as arrays:
+                    if "stats" in arrays:
+                        user_data["lexical"].add(LexicalSegment.from_arrays(dict(arrays)))
+            elif user_data["index"].ntotal:
+                # Snapshot from before the lexical index: build it from chunk text once
+                logger.info(f"Building lexical index for user {user_id} from the chunk store")
+                user_data["lexical"].add(_lexical_for_ids(user_data["store"], _live_ids(user_data)))
+
+            for seq in _list_segments(user_id):
+                if seq <= base_seq:
+                    continue
+                with np.load(_get_segment_path(user_id, seq), allow_pickle=False) as segment:
+                    _apply_segment(user_data, dict(segment))
+                user_data["seq"] = seq
+
+            # Rows beyond the replayed vectors belong to an upload whose segment was never written
+            dropped = user_data["store"].truncate(user_data["next_id"])
+            if dropped:
+                logger.warning(f"Dropped {dropped} orphaned chunk rows for user {user_id}")
 
-def save_user_index(user_id: str):
+            index = user_data["index"]
+            if index_kind(index) == "flat" and index_metric(index) != desired_metric():
+                # Cheap to convert on the spot (ANN kinds wait for the background rebuild)
+                logger.info(f"Converting index for user {user_id} to metric {desired_metric()}")
+                ids, vectors = _extract_vectors(user_data)
+                user_data["index"] = build_index("flat", vectors, ids, dimension=index.d)
+                user_data["id_map"] = None
+                save_user_index(user_id, user_data)
+
+        indices.put(user_id, user_data)
+        if _needs_compaction(user_data):
+            schedule_compaction(user_id)
+        return user_data
+
+def save_user_index(user_id: str, user_data: Optional[Dict[str, Any]] = None):
     """
-    Save user's in-memory index and metadata to disk.
+    Write a full base snapshot of the user's index, rewrite the chunk store
+    without rows of deleted vectors, then drop the segments (and older
+    snapshot) this supersedes.
+
+    This is the expensive path; uploads and deletes only append segments and
+    leave snapshotting to the background compaction.
     """
     user_id = str(user_id)
-    if user_id not in indices:
+    with _user_lock(user_id):
+        data = user_data if user_data is not None else indices.peek(user_id)
+        if data is None:
+            return
+
+        seq = data["seq"]
+        store = data["store"]
+        user_dir = _get_user_dir(user_id)
+        os.makedirs(user_dir, exist_ok=True)
+
+        live_ids = _live_ids(data)
+        if _needs_vector_backfill(data):
+            # Stores from before vectors were kept: fill them in from the index
+            ids, vectors = _extract_vectors(data)
+            store = store.rewrite(live_ids, generation=store.generation + 1, vectors=vectors[np.argsort(ids)])
+        elif len(store) != len(live_ids):
+            store = store.rewrite(live_ids, generation=store.generation + 1)
+
+        _atomic_write(_get_base_index_path(user_id, seq), faiss.serialize_index(data["index"]).tobytes())
+        lexical = data["lexical"].compacted(live_ids)
+        buffer = io.BytesIO()
+        np.savez(buffer, **(lexical.segments[0].to_arrays() if lexical.segments else {}))
+        _atomic_write(_get_lexical_path(user_id, seq), buffer.getvalue())
+        manifest = {
+            "format": LAYOUT_FORMAT,
+            "base_seq": seq,
+            "next_id": data["next_id"],
+            "chunk_gen": store.generation,
+            "deleted": sorted(data["deleted"]),
+            "recall": data["recall"],
+        }
+        # The manifest switch is the commit point for the new snapshot
+        _atomic_write(_get_manifest_path(user_id), json.dumps(manifest).encode("utf-8"))
+
+        with _search_lock(user_id).write():
+            if store is not data["store"]:
+                # Open maps of the old generation stay valid until dropped
+                data["store"].delete_files()
+                data["store"] = store
+            data["lexical"] = lexical
+            data["base_seq"] = max(data["base_seq"], seq)
+
+        for name in os.listdir(user_dir):
+            if name.startswith("seg-") and name.endswith(".npz") and int(name[4:-4]) <= seq:
+                os.remove(os.path.join(user_dir, name))
+            elif name.startswith("base-") and name != f"base-{seq:08d}.index":
+                os.remove(os.path.join(user_dir, name))
+            elif name.startswith("lex-") and name != f"lex-{seq:08d}.npz":
+                os.remove(os.path.join(user_dir, name))
+
+    logger.info(f"Saved index snapshot for user {user_id} at segment {seq}")
+
+def _extract_vectors(user_data: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (ids, vectors) of every live vector, reconstructed from the index itself.
+    """
+    index = user_data["index"]
+    ids = _id_map(user_data)
+    vectors = index.index.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), dtype="float32")
+    if user_data["deleted"]:
+        keep = ~np.isin(ids, np.fromiter(user_data["deleted"], dtype="int64"))
+        ids, vectors = ids[keep], vectors[keep]
+    return ids, vectors
+
+def _needs_vector_backfill(user_data: Dict[str, Any]) -> bool:
+    return settings.FAISS_EXACT_RERANK and not user_data["store"].has_vectors
+
+def _source_vectors(user_data: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (ids, vectors) of every live vector to build an index from: the exact
+    copies in the chunk store when it has them, else reconstructed from the
+    index (lossy for compressed kinds).
+    """
+    store = user_data["store"]
+    if len(store) and store.has_vectors:
+        ids = _live_ids(user_data)
+        exact = store.vectors(ids)
+        if exact is not None:
+            return ids, exact
+    return _extract_vectors(user_data)
+
+def _measure_recall(index, ids: np.ndarray, vectors: np.ndarray, rerank: bool, k: int = 10) -> Optional[float]:
+    """
+    Recall@k of searching `index` (as search_index_batch does, so counting
+    the re-scored candidate pool when `rerank`) against exact search over
+    `vectors`, using a sample of the indexed vectors as queries.
+    """
+    nq = min(settings.FAISS_RECALL_SAMPLE, len(ids))
+    if nq <= 0 or len(ids) <= k:
+        return None
+    metric = index_metric(index)
+    rng = np.random.default_rng(0)
+    queries = np.ascontiguousarray(vectors[rng.choice(len(ids), nq, replace=False)], dtype="float32")
+    if metric == "ip":
+        queries = normalized(queries)
+
+    # Exact top-k, a block of vectors at a time
+    best_scores = np.zeros((nq, 0), dtype="float32")
+    best_ids = np.zeros((nq, 0), dtype="int64")
+    for start in range(0, len(ids), 65536):
+        block = np.asarray(vectors[start:start + 65536], dtype="float32")
+        scores = _pairwise(queries, normalized(block) if metric == "ip" else block, metric)
+        scores = np.hstack([best_scores, scores])
+        block_ids = np.hstack([best_ids, np.broadcast_to(ids[start:start + 65536], (nq, len(block)))])
+        order = _best_first(scores, metric)[:, :k]
+        best_scores = np.take_along_axis(scores, order, axis=1)
+        best_ids = np.take_along_axis(block_ids, order, axis=1)
+
+    fetch = k * max(1, settings.FAISS_RERANK_FACTOR) if rerank else k
+    _, positions = index.index.search(queries, fetch, params=search_params(index, fetch))
+    id_map = faiss.vector_to_array(index.id_map)
+    found = 0
+    for truth, row in zip(best_ids, positions):
+        found += len(set(truth.tolist()) & {int(id_map[pos]) for pos in row if pos != -1})
+    return found / (nq * k)
+
+def _rebuild(user_id: str):
+    """
+    Rebuild the user's index as the kind its size tier calls for, with the
+    configured metric and without tombstoned vectors (existing indexes switch
+    metric this way, from their stored vectors). Training/building runs outside the user lock; anything
+    appended meanwhile is replayed from its segments before the swap.
+    """
+    with _user_lock(user_id):
+        user_data = load_user_index(user_id)
+        ids, vectors = _source_vectors(user_data)
+        built_seq = user_data["seq"]
+        kind = desired_kind(len(ids))
+
+    logger.info(f"Building {kind} ({desired_metric()}) index over {len(ids)} vectors for user {user_id}")
+    rebuilt = _new_entry(user_data["store"], index=build_index(kind, vectors, ids), next_id=user_data["next_id"])
+    if kind != "flat":
+        rerank = settings.FAISS_EXACT_RERANK and is_lossy(rebuilt["index"]) and user_data["store"].has_vectors
+        rebuilt["recall"] = _measure_recall(rebuilt["index"], ids, vectors, rerank=rerank)
+        if rebuilt["recall"] is not None:
+            logger.info(f"Recall@10 of the {kind} index for user {user_id} vs exact search: {rebuilt['recall']:.3f}")
+
+    with _user_lock(user_id):
+        current = indices.peek(user_id) or load_user_index(user_id)
+        for seq in range(built_seq + 1, current["seq"] + 1):
+            with np.load(_get_segment_path(user_id, seq), allow_pickle=False) as segment:
+                # the live lexical index already has these; only the vectors are replayed
+                _apply_segment(rebuilt, dict(segment), lexical=False)
+        with _search_lock(user_id).write():
+            current["index"] = rebuilt["index"]
+            current["deleted"] = rebuilt["deleted"]
+            current["recall"] = rebuilt["recall"]
+            current["id_map"] = None
+        indices.resize(user_id)
+
+def _compact(user_id: str):
+    try:
+        user_data = load_user_index(user_id)
+        index = user_data["index"]
+        if (
+            user_data["deleted"]
+            or index_kind(index) != desired_kind(index.ntotal)
+            or index_metric(index) != desired_metric()
+        ):
+            if _needs_vector_backfill(user_data) and not is_lossy(index):
+                # Snapshot first, so the backfilled vectors come from the exact index
+                save_user_index(user_id, user_data)
+            _rebuild(user_id)
+        save_user_index(user_id, load_user_index(user_id))
+    except Exception as e:
+        logger.warning(f"Compaction failed for user {user_id}: {e}")
         return
+    finally:
+        with _compacting_guard:
+            _compacting.discard(user_id)
 
-    data = indices[user_id]
-    index_path = _get_user_index_path(user_id)
-    meta_path = _get_user_metadata_path(user_id)
+    # Requests skipped while this run was in flight (e.g. a tier crossed mid-run)
+    user_data = indices.peek(user_id)
+    if user_data is not None and _needs_compaction(user_data):
+        schedule_compaction(user_id)
 
-    faiss.write_index(data["index"], index_path)
-    with open(meta_path, "wb") as f:
-        pickle.dump(data["metadata"], f)
-    
-    logger.info(f"Saved index for user {user_id}")
+def schedule_compaction(user_id: str):
+    """
+    Merge the user's segments into a new base snapshot in the background.
+    """
+    user_id = str(user_id)
+    with _compacting_guard:
+        if user_id in _compacting:
+            return
+        _compacting.add(user_id)
+    _compactor.submit(_compact, user_id)
 
 def add_embeddings(user_id: str, embeddings: np.ndarray, metadatas: List[Dict[str, Any]]):
     """
     Add embeddings to the user's FAISS index.
+    Each vector gets a fresh, never-reused ID so it can be removed later.
+    """
+    user_id = str(user_id)
+    with _user_lock(user_id):
+        user_data = load_user_index(user_id)
+
+        # Ensure embeddings are float32 (and unit length for inner-product search)
+        if desired_metric() == "ip":
+            embeddings = normalized(embeddings)
+        elif embeddings.dtype != "float32":
+            embeddings = embeddings.astype("float32")
+
+        start = user_data["next_id"]
+        ids = np.arange(start, start + len(embeddings), dtype="int64")
+        lexical = LexicalSegment.build(ids.tolist(), [m.get("text", "") for m in metadatas])
+        segment = {"op": np.array("add"), "ids": ids, "vectors": embeddings, **lexical.to_arrays(prefix="lex_")}
+        store = user_data["store"]
+        with _search_lock(user_id).write():
+            # Chunk rows first: a vector is only searchable once its segment exists
+            store.append(ids, metadatas, vectors=embeddings if settings.FAISS_EXACT_RERANK else None)
+        try:
+            _append_segment(user_id, user_data, segment)
+        except Exception:
+            # The vectors never became durable: take their rows back out
+            with _search_lock(user_id).write():
+                store.truncate(start)
+            raise
+        with _search_lock(user_id).write():
+            _apply_segment(user_data, segment)
+        _bump_version(user_id)
+        indices.resize(user_id)
+        if _needs_compaction(user_data):
+            schedule_compaction(user_id)
+
+def _positions_for_documents(user_data: Dict[str, Any], document_ids: List[str]) -> np.ndarray:
+    """
+    Internal index positions of the live vectors belonging to `document_ids`.
+    """
+    store = user_data["store"]
+    wanted = []
+    for document_id in document_ids:
+        try:
+            wanted.append(store.ids_for_document(document_id))
+        except ValueError:
+            logger.warning(f"Ignoring invalid document_id filter {document_id!r}")
+    if not wanted:
+        return np.zeros(0, dtype="int64")
+
+    wanted_ids = np.concatenate(wanted)
+    if user_data["deleted"]:
+        wanted_ids = wanted_ids[~np.isin(wanted_ids, np.fromiter(user_data["deleted"], dtype="int64"))]
+    return np.nonzero(np.isin(_id_map(user_data), wanted_ids))[0].astype("int64")
+
+def get_index_info(user_id: str) -> Dict[str, Any]:
+    """
+    Kind, metric, size and measured recall of the user's index.
+    """
+    user_data = load_user_index(str(user_id))
+    with _search_lock(str(user_id)).read():
+        index = user_data["index"]
+        return {
+            "kind": index_kind(index),
+            "metric": index_metric(index),
+            "vectors": index.ntotal - len(user_data["deleted"]),
+            "bytes": _entry_nbytes(user_data),
+            "exact_vectors": user_data["store"].has_vectors,
+            "recall_at_10": user_data["recall"],
+        }
+
+
+def _read_version(user_id: str) -> int:
+    try:
+        with open(_get_version_path(user_id), "r") as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return 0
+
+
+def _bump_version(user_id: str):
+    """
+    Record a change to the user's searchable documents (called under the
+    user lock, once the change is applied).
+    """
+    os.makedirs(INDICES_DIR, exist_ok=True)
+    _atomic_write(_get_version_path(user_id), str(_read_version(user_id) + 1).encode("utf-8"))
+
+
+def index_version(user_id: str) -> str:
     """
+    Opaque token that changes whenever the user's documents do: a counter
+    bumped by every upload, delete and wipe (not by compaction, which leaves
+    search results alone). It lives on disk, so all worker processes see it.
+    """
+    return str(_read_version(str(user_id)))
+
+
+def _pairwise(query_vectors: np.ndarray, vectors: np.ndarray, metric: str) -> np.ndarray:
+    """
+    (n_queries, n_vectors) inner products, or squared L2 distances.
+    """
+    if metric == "ip":
+        return query_vectors @ vectors.T
+    dists = (
+        (query_vectors ** 2).sum(axis=1)[:, None]
+        - 2.0 * query_vectors @ vectors.T
+        + (vectors ** 2).sum(axis=1)[None, :]
+    )
+    np.maximum(dists, 0.0, out=dists)
+    return dists
+
+def _best_first(scores: np.ndarray, metric: str) -> np.ndarray:
+    return np.argsort(-scores if metric == "ip" else scores, axis=1, kind="stable")
+
+def _rescore_exact(
+    store: ChunkStore,
+    query_vectors: np.ndarray,
+    hits_per_query: List[List[Tuple[float, int]]],
+    metric: str,
+) -> List[List[Tuple[float, int]]]:
+    """
+    Re-score and re-order candidate (score, vector ID) hits with the vectors
+    kept in the chunk store (memory-mapped, so only these rows are read).
+    """
+    unique_ids = sorted({vector_id for hits in hits_per_query for _, vector_id in hits})
+    vectors = store.vectors(unique_ids)
+    if vectors is None:
+        return hits_per_query
+    if metric == "ip":
+        # rows stored before a switch to inner product are not unit length
+        vectors = normalized(vectors)
+    row_of = {vector_id: row for row, vector_id in enumerate(unique_ids)}
+
+    rescored = []
+    for query, hits in zip(query_vectors, hits_per_query):
+        if not hits:
+            rescored.append([])
+            continue
+        ids = [vector_id for _, vector_id in hits]
+        scores = _pairwise(query[None, :], vectors[[row_of[i] for i in ids]], metric)
+        order = _best_first(scores, metric)[0]
+        rescored.append([(float(scores[0, j]), ids[j]) for j in order])
+    return rescored
+
+def search_index_batch(
+    user_id: str,
+    query_vectors: np.ndarray,
+    top_k: int = 5,
+    document_ids: Optional[List[str]] = None,
+    min_score: Optional[float] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Search with several query vectors at once (one row each): a single FAISS
+    call over the whole matrix and one chunk-store read for the union of
+    hits. Returns one result list per query row.
+
+    With FAISS_METRIC "ip", "score" is the cosine similarity (higher is
+    better) and hits below `min_score` are dropped; with "l2" it is the
+    squared L2 distance (lower is better) and `min_score` is ignored.
+    On compressed (sq8/pq/ivfpq) indexes, FAISS_RERANK_FACTOR x top_k
+    candidates are re-scored with the exact vectors kept in the chunk store.
+    Result metadata holds references only (chunk/document IDs, chunk index,
+    filename); chunk_text.hydrate() fetches the text.
+    """
+    # Ensure query vectors are float32 and (n_queries, dimension)
+    query_vectors = np.asarray(query_vectors, dtype="float32")
+    if len(query_vectors.shape) == 1:
+        query_vectors = np.expand_dims(query_vectors, axis=0)
+
     user_data = load_user_index(user_id)
+    with _search_lock(str(user_id)).read():
+        return _search_vectors(user_data, query_vectors, top_k, document_ids, min_score)
+
+def _search_vectors(
+    user_data: Dict[str, Any],
+    query_vectors: np.ndarray,
+    top_k: int,
+    document_ids: Optional[List[str]],
+    min_score: Optional[float],
+) -> List[List[Dict[str, Any]]]:
+    nq = len(query_vectors)
     index = user_data["index"]
-    
-    # Add vectors to FAISS
-    # Ensure embeddings are float32
-    if embeddings.dtype != "float32":
-        embeddings = embeddings.astype("float32")
-        
-    index.add(embeddings)
-    
-    # Append metadata
-    user_data["metadata"].extend(metadatas)
-    
-    # Save to disk
-    save_user_index(user_id)
-
-def search_index(user_id: str, query_vector: np.ndarray, top_k: int = 5):
-    """
-    Search the user's FAISS index for similar vectors.
+    deleted = user_data["deleted"]
+    store = user_data["store"]
+    metric = index_metric(index)
+    similarity = desired_metric() == "ip"
+    if metric == "ip":
+        query_vectors = normalized(query_vectors)
+    # Compressed codes only pick candidates; their stored vectors rank them
+    rerank = settings.FAISS_EXACT_RERANK and is_lossy(index) and len(store) > 0 and store.has_vectors
+    fetch = top_k * max(1, settings.FAISS_RERANK_FACTOR) if rerank else top_k
+
+    if index.ntotal - len(deleted) <= 0 or nq == 0:
+        return [[] for _ in range(nq)]
+
+    id_map = _id_map(user_data)
+
+    if document_ids:
+        positions = _positions_for_documents(user_data, document_ids)
+        if not len(positions):
+            return [[] for _ in range(nq)]
+
+        if len(positions) <= settings.FAISS_EXACT_FILTER_MAX or not supports_selector(index):
+            # Small selections: exact distances over just the selected vectors.
+            # Cheaper than a filtered scan, and IVF/HNSW filtered search can
+            # miss selected vectors sitting in unprobed lists / graph regions.
+            vectors = index.index.reconstruct_batch(positions)
+            dists = _pairwise(query_vectors, vectors, metric)
+            order = _best_first(dists, metric)[:, :fetch]
+            distances = np.take_along_axis(dists, order, axis=1)
+            positions = positions[order]
+        else:
+            k = min(fetch, len(positions))
+            selector = faiss.IDSelectorBatch(positions)
+            distances, positions = index.index.search(
+                query_vectors, k, params=search_params(index, k, selector=selector)
+            )
+    else:
+        # Search the wrapped index directly so per-search parameters (efSearch,
+        # nprobe) apply; over-fetch past any tombstones.
+        k = min(fetch + len(deleted), index.ntotal)
+        distances, positions = index.index.search(query_vectors, k, params=search_params(index, k))
+
+    hits_per_query = [
+        [
+            (float(dist), int(id_map[pos]))
+            for dist, pos in zip(row_distances, row_positions)
+            if pos != -1 and int(id_map[pos]) not in deleted
+        ][:fetch]
+        for row_distances, row_positions in zip(distances, positions)
+    ]
+    if rerank:
+        hits_per_query = _rescore_exact(store, query_vectors, hits_per_query, metric)
+
+    if similarity and metric == "l2":
+        # ANN index still awaiting its rebuild to inner product. The embedding
+        # model's vectors are unit length, so ||q - v||^2 = 2 - 2 cos(q, v)
+        hits_per_query = [
+            [(min(max(1.0 - dist / 2.0, -1.0), 1.0), vector_id) for dist, vector_id in hits]
+            for hits in hits_per_query
+        ]
+    if similarity and min_score is not None:
+        hits_per_query = [[hit for hit in hits if hit[0] >= min_score] for hits in hits_per_query]
+    hits_per_query = [hits[:top_k] for hits in hits_per_query]
+
+    # Only the (deduplicated) top-k rows are read from the chunk store
+    unique_ids = sorted({vector_id for hits in hits_per_query for _, vector_id in hits})
+    metadata_by_id = dict(zip(unique_ids, store.get(unique_ids)))
+
+    all_results = []
+    for hits in hits_per_query:
+        results = []
+        for dist, vector_id in hits:
+            doc_meta = metadata_by_id.get(vector_id)
+            if doc_meta is not None:
+                results.append({
+                    "score": float(dist),
+                    "metadata": doc_meta
+                })
+        all_results.append(results)
+
+    return all_results
+
+def search_lexical_batch(
+    user_id: str,
+    queries: List[str],
+    top_k: int = 5,
+    document_ids: Optional[List[str]] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    BM25 keyword search over the user's chunks, one result list per query in
+    the same shape as search_index_batch ("score" is the BM25 score, higher
+    is better).
     """
     user_data = load_user_index(user_id)
-    index = user_data["index"]
-    metadata = user_data["metadata"]
+    with _search_lock(str(user_id)).read():
+        return _search_lexical(user_data, queries, top_k, document_ids)
 
-    if index.ntotal == 0:
-        return []
+def _search_lexical(
+    user_data: Dict[str, Any],
+    queries: List[str],
+    top_k: int,
+    document_ids: Optional[List[str]],
+) -> List[List[Dict[str, Any]]]:
+    lexical = user_data["lexical"]
+
+    allowed = None
+    if document_ids:
+        wanted = []
+        for document_id in document_ids:
+            try:
+                wanted.append(user_data["store"].ids_for_document(document_id))
+            except ValueError:
+                logger.warning(f"Ignoring invalid document_id filter {document_id!r}")
+        if not wanted:
+            return [[] for _ in queries]
+        allowed = np.concatenate(wanted)
+
+    hits_per_query = [lexical.search(query, top_k, allowed=allowed) for query in queries]
+
+    unique_ids = sorted({vector_id for hits in hits_per_query for vector_id, _ in hits})
+    metadata_by_id = dict(zip(unique_ids, user_data["store"].get(unique_ids)))
 
-    # Ensure query vector is float32 and correct shape
-    if query_vector.dtype != "float32":
-        query_vector = query_vector.astype("float32")
-    
-    # FAISS expects (n_queries, dimension)
-    if len(query_vector.shape) == 1:
-        query_vector = np.expand_dims(query_vector, axis=0)
-
-    distances, indices_found = index.search(query_vector, top_k)
-    
-    results = []
-    # indices_found[0] contains the IDs of the nearest neighbors
-    # distances[0] contains the distances
-    for dist, idx in zip(distances[0], indices_found[0]):
-        if idx != -1 and idx < len(metadata):
-            doc_meta = metadata[idx]
-            results.append({
-                "score": float(dist),
-                "metadata": doc_meta
-            })
-            
-    return results
+    all_results = []
+    for hits in hits_per_query:
+        results = []
+        for vector_id, score in hits:
+            doc_meta = metadata_by_id.get(vector_id)
+            if doc_meta is not None:
+                results.append({
+                    "score": score,
+                    "metadata": doc_meta
+                })
+        all_results.append(results)
+
+    return all_results
+
+def remove_document(user_id: str, document_id: str) -> int:
+    """
+    Remove a single document's vectors from the user's index.
+    Their chunk rows are dropped at the next compaction.
+    Returns the number of vectors removed.
+    """
+    user_id = str(user_id)
+    document_id = str(document_id)
+    with _user_lock(user_id):
+        user_data = load_user_index(user_id)
+
+        candidates = user_data["store"].ids_for_document(document_id)
+        doomed = candidates[np.isin(candidates, _live_ids(user_data))]
+        if not len(doomed):
+            return 0
+
+        segment = {"op": np.array("delete"), "ids": doomed}
+        _append_segment(user_id, user_data, segment)
+        with _search_lock(user_id).write():
+            _apply_segment(user_data, segment)
+        _bump_version(user_id)
+        indices.resize(user_id)
+        if _needs_compaction(user_data):
+            schedule_compaction(user_id)
+
+    logger.info(f"Removed {len(doomed)} vectors of document {document_id} for user {user_id}")
+    return len(doomed)
 
 def clear_user_index(user_id: str):
     """
     Completely wipe the user's FAISS index and metadata from memory and disk.
-    Used when deleting documents to prevent 'Ghost Memory'.
     """
     user_id = str(user_id)
-    
-    # 1. Remove from Memory
-    if user_id in indices:
-        del indices[user_id]
-        logger.info(f"Cleared in-memory index for user {user_id}")
-
-    # 2. Remove from Disk
-    index_path = _get_user_index_path(user_id)
-    meta_path = _get_user_metadata_path(user_id)
-
-    if os.path.exists(index_path):
-        os.remove(index_path)
-        logger.info(f"Deleted index file: {index_path}")
-
-    if os.path.exists(meta_path):
-        os.remove(meta_path)
-        logger.info(f"Deleted metadata file: {meta_path}")
+    with _user_lock(user_id):
+        # 1. Remove from Memory
+        if indices.pop(user_id) is not None:
+            logger.info(f"Cleared in-memory index for user {user_id}")
+
+        # 2. Remove from Disk (snapshots, segments, chunk store and any legacy files)
+        user_dir = _get_user_dir(user_id)
+        if os.path.isdir(user_dir):
+            shutil.rmtree(user_dir)
+            logger.info(f"Deleted index directory: {user_dir}")
+
+        for path in (_get_legacy_index_path(user_id), _get_legacy_metadata_path(user_id)):
+            if os.path.exists(path):
+                os.remove(path)
+                logger.info(f"Deleted legacy index file: {path}")
+
+        _bump_version(user_id)
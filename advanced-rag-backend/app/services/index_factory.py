@@ -0,0 +1,226 @@
+# app/services/index_factory.py
+
+from __future__ import annotations
+
+import logging
+import math
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Dimension 384 for standard embeddings (e.g., all-MiniLM-L6-v2)
+# Adjust if using a different model dimension
+DIMENSION = 384
+
+INDEX_KINDS = ("flat", "fp16", "sq8", "pq", "hnsw", "ivf", "ivfpq")
+
+# Codes too coarse to rank final hits by; their candidates are re-scored exactly
+LOSSY_KINDS = ("sq8", "pq", "ivfpq")
+
+_SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# PQ codebooks (256 centroids per sub-quantizer) need ~39 training points per centroid
+PQ_MIN_TRAIN = 256 * 39
+
+METRICS = {"ip": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+
+
+def desired_kind(ntotal: int) -> str:
+    """
+    Index type for a corpus of `ntotal` vectors, from FAISS_INDEX_TIERS
+    ({min_vectors: kind}); the largest threshold not above ntotal wins.
+    """
+    kind = "flat"
+    for threshold, tier_kind in sorted(settings.FAISS_INDEX_TIERS.items()):
+        if ntotal >= int(threshold):
+            kind = tier_kind
+    if kind not in INDEX_KINDS:
+        logger.warning(f"Unknown index kind {kind!r} in FAISS_INDEX_TIERS; using flat")
+        return "flat"
+    if kind in ("pq", "ivfpq") and ntotal < PQ_MIN_TRAIN:
+        return "sq8"
+    return kind
+
+
+def desired_metric() -> str:
+    """
+    Distance metric new indexes are built with (FAISS_METRIC). "ip" indexes
+    hold L2-normalized vectors, so inner product is cosine similarity.
+    """
+    metric = settings.FAISS_METRIC
+    if metric not in METRICS:
+        logger.warning(f"Unknown FAISS_METRIC {metric!r}; using l2")
+        return "l2"
+    return metric
+
+
+def index_metric(index) -> str:
+    inner = faiss.downcast_index(index.index)
+    return "ip" if inner.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def normalized(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2-normalized float32 copy of a (n, d) matrix (zero rows stay zero).
+    """
+    vectors = np.array(vectors, dtype="float32", order="C")
+    if vectors.ndim == 2 and len(vectors):
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def index_kind(index) -> str:
+    """
+    Kind of an ID-mapped index, by the type of the index it wraps.
+    """
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(inner, faiss.IndexPQ):
+        return "pq"
+    return "flat"
+
+
+def is_lossy(index) -> bool:
+    return index_kind(index) in LOSSY_KINDS
+
+
+def supports_remove(index) -> bool:
+    # HNSW graphs cannot drop nodes, and the IVF direct map (kept so vectors can
+    # be reconstructed for rebuilds) cannot remove through the ID-map wrapper.
+    # Deletions on those are tombstoned until the next rebuild.
+    return index_kind(index) in ("flat", "fp16", "sq8", "pq")
+
+
+def supports_selector(index) -> bool:
+    return index_kind(index) != "pq"
+
+
+def _nlist_for(ntotal: int) -> int:
+    # ~4*sqrt(n) lists, but keep >= 39 training points per centroid
+    nlist = int(4 * math.sqrt(max(ntotal, 1)))
+    return max(1, min(nlist, 65536, ntotal // 39))
+
+
+def new_index(kind: str = "flat", ntotal: int = 0, dimension: int = DIMENSION, metric: Optional[str] = None):
+    """
+    Empty, untrained ID-mapped index of the given kind sized for ~ntotal
+    vectors, using `metric` ("ip" or "l2"; FAISS_METRIC by default).
+    """
+    metric_type = METRICS[metric or desired_metric()]
+    if kind == "hnsw":
+        inner = faiss.IndexHNSWFlat(dimension, settings.FAISS_HNSW_M, metric_type)
+        inner.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+    elif kind == "ivf":
+        inner = faiss.index_factory(dimension, f"IVF{_nlist_for(ntotal)},Flat", metric_type)
+    elif kind == "ivfpq":
+        inner = faiss.index_factory(dimension, f"IVF{_nlist_for(ntotal)},PQ{settings.FAISS_PQ_M}", metric_type)
+    elif kind in _SQ_TYPES:
+        inner = faiss.IndexScalarQuantizer(dimension, _SQ_TYPES[kind], metric_type)
+    elif kind == "pq":
+        inner = faiss.IndexPQ(dimension, settings.FAISS_PQ_M, 8, metric_type)
+    elif metric_type == faiss.METRIC_INNER_PRODUCT:
+        inner = faiss.IndexFlatIP(dimension)
+    else:
+        inner = faiss.IndexFlatL2(dimension)
+
+    if isinstance(inner, faiss.IndexIVF):
+        # Lets vectors be reconstructed for later rebuilds (tier changes, tombstone purges)
+        inner.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+    index = faiss.IndexIDMap2(inner)
+    tune_index(index)
+    return index
+
+
+def build_index(kind: str, vectors: np.ndarray, ids: np.ndarray, dimension: int = DIMENSION, metric: Optional[str] = None):
+    """
+    Build (train + add) an ID-mapped index of `kind` over the given vectors,
+    normalizing them first for "ip". Slow for the ANN kinds; callers run it
+    off the request path.
+    """
+    ntotal = len(vectors)
+    metric = metric or desired_metric()
+    index = new_index(kind, ntotal=ntotal, dimension=dimension, metric=metric)
+    if metric == "ip":
+        vectors = normalized(vectors)
+    inner = faiss.downcast_index(index.index)
+    if not inner.is_trained:
+        sample = vectors
+        if ntotal > settings.FAISS_TRAIN_SAMPLE:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(ntotal, settings.FAISS_TRAIN_SAMPLE, replace=False)]
+        inner.train(np.ascontiguousarray(sample, dtype="float32"))
+    if ntotal:
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype="float32"), ids.astype("int64"))
+    return index
+
+
+def tune_index(index):
+    """
+    Apply the recall-vs-latency knobs from settings to a (loaded or new) index.
+    """
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+    elif isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = settings.FAISS_IVF_NPROBE
+
+
+def search_params(index, top_k: int, selector=None) -> Optional[faiss.SearchParameters]:
+    """
+    Per-search parameters for the wrapped index (optionally with an ID selector
+    over its internal positions).
+    """
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        # efSearch below k would cap the number of results
+        params = faiss.SearchParametersHNSW(efSearch=max(settings.FAISS_HNSW_EF_SEARCH, top_k))
+    elif isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(nprobe=settings.FAISS_IVF_NPROBE)
+    elif isinstance(inner, faiss.IndexPQ):
+        # rejects generic parameters, and has no selector support (see supports_selector)
+        params = faiss.SearchParametersPQ()
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def index_nbytes(index) -> int:
+    """
+    Approximate resident size of an ID-mapped index (codes, graph/lists, ID maps).
+    """
+    ntotal = index.ntotal
+    inner = faiss.downcast_index(index.index)
+    # id_map vector (8 bytes/id) + rev_map hash table (~40 bytes/entry)
+    size = ntotal * (8 + 40)
+    if isinstance(inner, faiss.IndexHNSW):
+        storage = faiss.downcast_index(inner.storage)
+        size += ntotal * getattr(storage, "code_size", index.d * 4)
+        # level-0 links (2*M ints) plus upper levels (~1/M of nodes)
+        size += int(ntotal * inner.hnsw.nb_neighbors(0) * 4 * 1.1)
+    elif isinstance(inner, faiss.IndexIVF):
+        # codes + stored list ids + direct map + coarse centroids
+        size += ntotal * (inner.code_size + 8 + 40) + inner.nlist * index.d * 4
+    else:
+        size += ntotal * getattr(inner, "code_size", index.d * 4)
+        if isinstance(inner, faiss.IndexPQ):
+            size += inner.pq.M * inner.pq.ksub * inner.pq.dsub * 4  # codebooks
+    return size
@@ -0,0 +1,420 @@
+# app/services/ingestion.py
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.core.db import SessionLocal
+from app.models.document import Document, DocumentChunk
+from app.models.ingestion import IngestionJob
+from app.services.embeddings import embed_texts
+from app.services.faiss_store import add_embeddings, remove_document
+from app.services.pdf_extract import iter_pdf_pages, pdf_page_count, shutdown_pool
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+# ------------------------------
+# Streaming text extraction + chunking
+# ------------------------------
+
+TEXT_READ_CHARS = 1 << 20
+
+
+class _TextSource:
+    """
+    Iterates a stored document as text pieces (pages for PDFs, fixed-size
+    reads otherwise); `progress` tracks how much of the file has been read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.progress = 0.0
+
+    def __iter__(self) -> Iterator[str]:
+        if self.path.lower().endswith(".pdf"):
+            return self._iter_pdf()
+        return self._iter_generic()
+
+    def _iter_pdf(self) -> Iterator[str]:
+        """
+        Text of non-empty pages, separated by blank lines; pages come from the
+        extraction process pool in order.
+        """
+        try:
+            num_pages = pdf_page_count(self.path)
+        except Exception as e:
+            logger.warning("Failed to parse PDF %s with pdfplumber: %s", self.path, e)
+            return
+
+        # Errors past the first page (e.g. a broken extraction pool) propagate,
+        # so the job fails rather than indexing a truncated document
+        first = True
+        for number, text in enumerate(iter_pdf_pages(self.path, num_pages), start=1):
+            self.progress = number / max(num_pages, 1)
+            if not text.strip():
+                continue
+            yield text if first else "\n\n" + text
+            first = False
+
+    def _iter_generic(self) -> Iterator[str]:
+        """
+        Fallback for txt/md/etc. Very simple. You can extend to DOCX later.
+        """
+        try:
+            size = max(os.path.getsize(self.path), 1)
+            f = open(self.path, "r", encoding="utf-8", errors="ignore")
+        except Exception as e:
+            logger.warning("Failed to read %s as text: %s", self.path, e)
+            return
+
+        with f:
+            while True:
+                piece = f.read(TEXT_READ_CHARS)
+                if not piece:
+                    break
+                self.progress = min(f.buffer.tell() / size, 1.0)
+                yield piece
+
+
+def _iter_chunks(pieces: Iterable[str], max_chars: int = 1000, overlap: int = 200) -> Iterator[str]:
+    """
+    Fixed-size overlapping character windows over a stream of text pieces.
+
+    Produces exactly the chunks a single pass over the concatenated (and
+    stripped) text would, while only buffering about one window plus the
+    current piece.
+    """
+    step = max_chars - overlap
+    buf = ""
+    started = False
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        buf += piece
+        # Trailing whitespace may turn out to be the end of the document, so
+        # only windows ending before the last non-whitespace char are final.
+        core = len(buf.rstrip())
+        start = 0
+        while start + max_chars < core:
+            chunk = buf[start:start + max_chars].strip()
+            if chunk:
+                yield chunk
+            start += step
+        buf = buf[start:]
+
+    chunk = buf.strip()
+    if chunk:
+        yield chunk
+
+
+def _iter_batches(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ------------------------------
+# Queue API
+# ------------------------------
+
+def enqueue_ingestion(db: Session, document: Document) -> IngestionJob:
+    """
+    Add a queued job for `document` to the session (the caller commits, then
+    calls notify_workers()).
+    """
+    job = IngestionJob(
+        id=uuid.uuid4(),
+        user_id=document.user_id,
+        document_id=document.id,
+        status="queued",
+        progress=0.0,
+        attempts=0,
+        created_at=datetime.utcnow(),
+    )
+    db.add(job)
+    return job
+
+
+def notify_workers() -> None:
+    """
+    Wake the dispatcher so freshly committed jobs start without waiting a poll.
+    """
+    _wakeup.set()
+
+
+# ------------------------------
+# Job execution
+# ------------------------------
+
+def _set_progress(db: Session, job: IngestionJob, stage: str, progress: float) -> None:
+    job.stage = stage
+    job.progress = progress
+    job.heartbeat_at = datetime.utcnow()
+    db.commit()
+
+
+def _finish(db: Session, job: IngestionJob, status: str, error: Optional[str] = None) -> None:
+    job.status = status
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    job.heartbeat_at = job.finished_at
+    if status == "succeeded":
+        job.stage = "done"
+        job.progress = 1.0
+    db.commit()
+
+
+def _discard_vectors_and_chunks(db: Session, document_id: uuid.UUID, user_id: uuid.UUID) -> None:
+    db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete()
+    remove_document(user_id, document_id)
+
+
+def _document_exists(db: Session, document_id: uuid.UUID) -> bool:
+    return db.query(Document.id).filter(Document.id == document_id).first() is not None
+
+
+def _run_job(db: Session, job: IngestionJob) -> None:
+    """
+    Stream the document through extract -> chunk -> embed -> index.
+
+    Each stage is a generator pulling from the previous one, so at most one
+    embedding batch (INGEST_BATCH_SIZE chunks) plus one text window is held
+    at a time, whatever the document size. Every batch is written to the DB
+    (one multi-row INSERT, committed together with the job's progress) and
+    FAISS before the next one is extracted.
+    """
+    doc = db.get(Document, job.document_id)
+    if doc is None:
+        _finish(db, job, "failed", "Document was deleted before ingestion")
+        return
+
+    # A retried job may have been interrupted half-way; start from a clean slate
+    _discard_vectors_and_chunks(db, doc.id, doc.user_id)
+    doc.num_chunks = 0
+    _set_progress(db, job, "extracting", 0.0)
+
+    doc_id, user_id, filename = doc.id, doc.user_id, doc.filename
+    source = _TextSource(doc.stored_path)
+    chunks = _iter_chunks(source, max_chars=1000, overlap=200)
+
+    num_chunks = 0
+    for batch in _iter_batches(chunks, settings.INGEST_BATCH_SIZE):
+        vectors = np.asarray(embed_texts(batch), dtype="float32")
+
+        # The document may have been deleted while we were working on it
+        if not _document_exists(db, doc_id):
+            _discard_vectors_and_chunks(db, doc_id, user_id)
+            db.commit()
+            return
+
+        # IDs are generated here, so rows go out as one bulk INSERT with
+        # nothing to read back
+        now = datetime.utcnow()
+        rows = [
+            {
+                "id": uuid.uuid4(),
+                "document_id": doc_id,
+                "user_id": user_id,
+                "chunk_index": num_chunks + offset,
+                "text": chunk_text,
+                "created_at": now,
+            }
+            for offset, chunk_text in enumerate(batch)
+        ]
+        db.execute(insert(DocumentChunk), rows)
+        # extraction drives the pipeline, so its progress is the job's;
+        # this commit also persists the batch's chunk rows
+        _set_progress(db, job, "indexing", 0.95 * source.progress)
+
+        metadatas = [
+            {
+                "chunk_id": str(row["id"]),
+                "document_id": str(doc_id),
+                "chunk_index": row["chunk_index"],
+                "filename": filename,
+                "text": row["text"],
+            }
+            for row in rows
+        ]
+        add_embeddings(user_id=user_id, embeddings=vectors, metadatas=metadatas)
+        num_chunks += len(batch)
+
+    if num_chunks == 0:
+        logger.warning(
+            "No extractable text for document %s (path=%s). num_chunks will stay 0.",
+            doc_id,
+            doc.stored_path,
+        )
+    else:
+        logger.info("Document %s ingested as %d chunks.", doc_id, num_chunks)
+
+    db.expire_all()
+    doc = db.get(Document, doc_id)
+    if doc is None:
+        _discard_vectors_and_chunks(db, doc_id, user_id)
+        db.commit()
+        return
+
+    doc.num_chunks = num_chunks
+    _finish(db, job, "succeeded")
+
+
+def _execute(job_id: uuid.UUID) -> None:
+    db = SessionLocal()
+    try:
+        job = db.get(IngestionJob, job_id)
+        if job is None:
+            return
+        try:
+            _run_job(db, job)
+        except Exception as e:
+            logger.exception("Ingestion job %s failed", job_id)
+            db.rollback()
+            job = db.get(IngestionJob, job_id)
+            if job is not None:
+                # don't leave a half-indexed document searchable
+                try:
+                    _discard_vectors_and_chunks(db, job.document_id, job.user_id)
+                except Exception:
+                    logger.exception("Cleanup after failed ingestion job %s failed", job_id)
+                    db.rollback()
+                _finish(db, job, "failed", str(e)[:2000])
+    finally:
+        db.close()
+        with _inflight_lock:
+            global _inflight
+            _inflight -= 1
+        _wakeup.set()
+
+
+# ------------------------------
+# Dispatcher (DB-polled worker pool)
+# ------------------------------
+
+_pool: Optional[ThreadPoolExecutor] = None
+_dispatcher: Optional[threading.Thread] = None
+_stop = threading.Event()
+_wakeup = threading.Event()
+_inflight = 0
+_inflight_lock = threading.Lock()
+
+
+def _claim(db: Session, job_id: uuid.UUID) -> bool:
+    """
+    Atomically move a job from queued to running; False if someone else won.
+    """
+    now = datetime.utcnow()
+    result = db.execute(
+        update(IngestionJob)
+        .where(IngestionJob.id == job_id, IngestionJob.status == "queued")
+        .values(
+            status="running",
+            started_at=now,
+            heartbeat_at=now,
+            attempts=IngestionJob.attempts + 1,
+        )
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def _requeue_stale(db: Session) -> None:
+    """
+    Put jobs whose worker stopped heartbeating (crash/restart) back in the queue,
+    or fail them once they have used up their attempts.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.INGEST_STALE_SECONDS)
+    stale = (
+        db.query(IngestionJob)
+        .filter(IngestionJob.status == "running", IngestionJob.heartbeat_at < cutoff)
+        .all()
+    )
+    for job in stale:
+        if job.attempts >= settings.INGEST_MAX_ATTEMPTS:
+            logger.warning("Ingestion job %s abandoned after %d attempts", job.id, job.attempts)
+            job.status = "failed"
+            job.error = "Worker stopped responding"
+            job.finished_at = datetime.utcnow()
+        else:
+            logger.info("Re-queueing stale ingestion job %s", job.id)
+            job.status = "queued"
+    if stale:
+        db.commit()
+
+
+def _dispatch_loop() -> None:
+    global _inflight
+    while not _stop.is_set():
+        try:
+            with _inflight_lock:
+                free = settings.INGEST_WORKERS - _inflight
+            if free > 0:
+                db = SessionLocal()
+                try:
+                    _requeue_stale(db)
+                    queued = (
+                        db.query(IngestionJob.id)
+                        .filter(IngestionJob.status == "queued")
+                        .order_by(IngestionJob.created_at)
+                        .limit(free)
+                        .all()
+                    )
+                    for (job_id,) in queued:
+                        if _claim(db, job_id):
+                            with _inflight_lock:
+                                _inflight += 1
+                            _pool.submit(_execute, job_id)
+                finally:
+                    db.close()
+        except Exception as e:
+            logger.warning("Ingestion dispatcher error: %s", e)
+
+        _wakeup.wait(settings.INGEST_POLL_SECONDS)
+        _wakeup.clear()
+
+
+def start_workers() -> None:
+    """
+    Start the worker pool and dispatcher; queued (or orphaned) jobs from a
+    previous run are picked up automatically.
+    """
+    global _pool, _dispatcher
+    if _dispatcher is not None:
+        return
+    _stop.clear()
+    _pool = ThreadPoolExecutor(max_workers=settings.INGEST_WORKERS, thread_name_prefix="ingest")
+    _dispatcher = threading.Thread(target=_dispatch_loop, name="ingest-dispatcher", daemon=True)
+    _dispatcher.start()
+
+
+def stop_workers() -> None:
+    global _pool, _dispatcher
+    if _dispatcher is None:
+        return
+    _stop.set()
+    _wakeup.set()
+    _dispatcher.join(timeout=5)
+    _pool.shutdown(wait=False)
+    _pool, _dispatcher = None, None
+    shutdown_pool()
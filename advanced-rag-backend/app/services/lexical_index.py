@@ -0,0 +1,256 @@
+# app/services/lexical_index.py
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Words, numbers and identifiers such as "err-4512", "xj_9000" or "v1.2.3".
+# Compound tokens are indexed whole *and* by their parts, so both the exact
+# identifier and its pieces match.
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+_SEPARATORS = re.compile(r"[-_./:]")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or "
+    "that the this to was were will with what which who how".split()
+)
+
+_ARRAYS = ("terms", "offsets", "ids", "tf", "dl")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if _SEPARATORS.search(token):
+            tokens.extend(p for p in _SEPARATORS.split(token) if p and p not in _STOPWORDS)
+    return tokens
+
+
+def _term_hash(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _hashes(tokens: Iterable[str]) -> np.ndarray:
+    return np.array([_term_hash(t) for t in tokens], dtype=np.uint64)
+
+
+class LexicalSegment:
+    """
+    Immutable inverted index over one batch of chunks, as CSR arrays:
+
+      terms    sorted 64-bit term hashes            (T,)  uint64
+      offsets  posting range of each term           (T+1,) int64
+      ids      vector ID - id_base, per posting     (P,)  uint32
+      tf / dl  term frequency / chunk length        (P,)  uint16
+
+    i.e. 8 bytes per posting plus 16 per distinct term.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], id_base: int, doc_count: int, total_len: int):
+        self.terms = arrays["terms"]
+        self.offsets = arrays["offsets"]
+        self.ids = arrays["ids"]
+        self.tf = arrays["tf"]
+        self.dl = arrays["dl"]
+        self.id_base = id_base
+        self.doc_count = doc_count
+        self.total_len = total_len
+
+    @classmethod
+    def _from_postings(
+        cls, terms: np.ndarray, ids: np.ndarray, tf: np.ndarray, dl: np.ndarray, doc_count: int, total_len: int
+    ) -> "LexicalSegment":
+        order = np.lexsort((ids, terms))
+        terms, ids, tf, dl = terms[order], ids[order], tf[order], dl[order]
+        unique_terms, starts = np.unique(terms, return_index=True)
+        id_base = int(ids.min()) if len(ids) else 0
+        arrays = {
+            "terms": unique_terms.astype(np.uint64),
+            "offsets": np.append(starts, len(terms)).astype(np.int64),
+            "ids": (ids - id_base).astype(np.uint32),
+            "tf": np.minimum(tf, 65535).astype(np.uint16),
+            "dl": np.minimum(dl, 65535).astype(np.uint16),
+        }
+        return cls(arrays, id_base, doc_count, total_len)
+
+    @classmethod
+    def build(cls, ids: Sequence[int], texts: Sequence[str]) -> "LexicalSegment":
+        terms, post_ids, tfs, dls = [], [], [], []
+        total_len = 0
+        for vector_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text or ""))
+            length = sum(counts.values())
+            total_len += length
+            for token, count in counts.items():
+                terms.append(_term_hash(token))
+                post_ids.append(int(vector_id))
+                tfs.append(count)
+                dls.append(length)
+        return cls._from_postings(
+            np.array(terms, dtype=np.uint64),
+            np.array(post_ids, dtype=np.int64),
+            np.array(tfs, dtype=np.int64),
+            np.array(dls, dtype=np.int64),
+            doc_count=len(ids),
+            total_len=total_len,
+        )
+
+    def postings(self, term_hashes: np.ndarray) -> List[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        (query term index, ids, tf, dl) for each query term present here.
+        """
+        found = []
+        if not len(self.terms):
+            return found
+        pos = np.searchsorted(self.terms, term_hashes)
+        for i, p in enumerate(pos.tolist()):
+            if p < len(self.terms) and self.terms[p] == term_hashes[i]:
+                start, end = int(self.offsets[p]), int(self.offsets[p + 1])
+                found.append((
+                    i,
+                    self.ids[start:end].astype(np.int64) + self.id_base,
+                    self.tf[start:end],
+                    self.dl[start:end],
+                ))
+        return found
+
+    def to_arrays(self, prefix: str = "") -> Dict[str, np.ndarray]:
+        arrays = {f"{prefix}{name}": getattr(self, name) for name in _ARRAYS}
+        arrays[f"{prefix}stats"] = np.array([self.id_base, self.doc_count, self.total_len], dtype=np.int64)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], prefix: str = "") -> "LexicalSegment":
+        id_base, doc_count, total_len = (int(v) for v in arrays[f"{prefix}stats"])
+        return cls({name: arrays[f"{prefix}{name}"] for name in _ARRAYS}, id_base, doc_count, total_len)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in _ARRAYS)
+
+
+class LexicalIndex:
+    """
+    Per-user BM25 index: a list of append-only segments (one per upload)
+    plus tombstones for deleted vector IDs. `compacted` merges everything
+    into a single segment without the deleted postings.
+
+    Collection statistics (N, avgdl, df) include tombstoned chunks until the
+    next compaction, which only nudges scores slightly.
+    """
+
+    def __init__(self, segments: Optional[List[LexicalSegment]] = None):
+        self.segments: List[LexicalSegment] = list(segments or [])
+        self.deleted: set = set()
+        self._deleted_array: Optional[np.ndarray] = None
+
+    def add(self, segment: LexicalSegment) -> None:
+        self.segments = self.segments + [segment]
+
+    def delete(self, ids: Iterable[int]) -> None:
+        self.deleted.update(int(i) for i in ids)
+        self._deleted_array = None
+
+    def _deleted(self) -> np.ndarray:
+        deleted = self._deleted_array
+        if deleted is None:
+            deleted = self._deleted_array = np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted))
+        return deleted
+
+    @property
+    def nbytes(self) -> int:
+        return sum(s.nbytes for s in self.segments) + 16 * len(self.deleted)
+
+    def search(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Top-k (vector ID, BM25 score) for a query, optionally restricted to
+        the `allowed` vector IDs.
+        """
+        tokens = sorted(set(tokenize(query)))
+        segments = self.segments
+        if not tokens or not segments:
+            return []
+        term_hashes = _hashes(tokens)
+
+        doc_count = sum(s.doc_count for s in segments)
+        n_docs = max(doc_count - len(self.deleted), 1)
+        avgdl = max(sum(s.total_len for s in segments) / max(doc_count, 1), 1.0)
+
+        per_term: Dict[int, List[Tuple[np.ndarray, np.ndarray, np.ndarray]]] = {}
+        for segment in segments:
+            for i, ids, tf, dl in segment.postings(term_hashes):
+                per_term.setdefault(i, []).append((ids, tf, dl))
+        if not per_term:
+            return []
+
+        all_ids, all_scores = [], []
+        for parts in per_term.values():
+            df = sum(len(ids) for ids, _, _ in parts)
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            for ids, tf, dl in parts:
+                tf = tf.astype(np.float32)
+                norm = K1 * (1.0 - B + B * dl.astype(np.float32) / avgdl)
+                all_ids.append(ids)
+                all_scores.append(idf * tf * (K1 + 1.0) / (tf + norm))
+
+        ids = np.concatenate(all_ids)
+        scores = np.concatenate(all_scores)
+        keep = None
+        if self.deleted:
+            keep = ~np.isin(ids, self._deleted())
+        if allowed is not None:
+            allowed_mask = np.isin(ids, allowed)
+            keep = allowed_mask if keep is None else keep & allowed_mask
+        if keep is not None:
+            ids, scores = ids[keep], scores[keep]
+        if not len(ids):
+            return []
+
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+        if len(totals) > top_k:
+            top = np.argpartition(-totals, top_k)[:top_k]
+        else:
+            top = np.arange(len(totals))
+        top = top[np.argsort(-totals[top], kind="stable")]
+        return [(int(unique_ids[i]), float(totals[i])) for i in top]
+
+    def compacted(self, live_ids: np.ndarray) -> "LexicalIndex":
+        """
+        A single-segment copy holding only postings of `live_ids`.
+        """
+        segments = self.segments
+        if not segments:
+            return LexicalIndex()
+        terms = np.concatenate([np.repeat(s.terms, np.diff(s.offsets)) for s in segments])
+        ids = np.concatenate([s.ids.astype(np.int64) + s.id_base for s in segments])
+        tf = np.concatenate([s.tf for s in segments])
+        dl = np.concatenate([s.dl for s in segments])
+
+        keep = np.isin(ids, live_ids)
+        terms, ids, tf, dl = terms[keep], ids[keep], tf[keep], dl[keep]
+
+        # Per-chunk lengths of the survivors, for avgdl
+        unique_ids, first = np.unique(ids, return_index=True)
+        total_len = int(dl[first].astype(np.int64).sum())
+        merged = LexicalSegment._from_postings(
+            terms, ids, tf, dl, doc_count=len(live_ids), total_len=total_len
+        )
+        return LexicalIndex([merged])
@@ -0,0 +1,144 @@
+# app/services/pdf_extract.py
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Deque, Iterator, List, Optional
+
+import pdfplumber
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+# ------------------------------
+# Worker side (runs in the pool processes)
+# ------------------------------
+
+class _PageTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise _PageTimeout()
+
+
+def _extract_page_range(path: str, start: int, end: int, page_timeout: float) -> List[str]:
+    """
+    Text of pages [start, end) of a PDF, one string per page ("" for pages
+    that failed or ran past `page_timeout` seconds).
+    """
+    # pdfminer is pure Python, so an interval timer interrupts a stuck page
+    use_alarm = page_timeout > 0 and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+
+    texts: List[str] = []
+    with pdfplumber.open(path) as pdf:
+        pages = pdf.pages
+        for number in range(start, min(end, len(pages))):
+            page = pages[number]
+            try:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, page_timeout)
+                texts.append(page.extract_text() or "")
+            except _PageTimeout:
+                logger.warning("Page %d of %s timed out after %.1fs; skipping", number + 1, path, page_timeout)
+                texts.append("")
+            except Exception as e:
+                logger.warning("Failed to extract page %d of %s: %s", number + 1, path, e)
+                texts.append("")
+            finally:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+                # drop the page's parsed layout objects
+                page.close()
+    return texts
+
+
+# ------------------------------
+# Parent side
+# ------------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _workers() -> int:
+    return settings.PDF_EXTRACT_WORKERS or os.cpu_count() or 1
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the API process runs threads (ingest workers,
+            # FAISS/OpenMP) that a forked child could inherit mid-lock
+            _pool = ProcessPoolExecutor(
+                max_workers=_workers(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def pdf_page_count(path: str) -> int:
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def iter_pdf_pages(path: str, num_pages: Optional[int] = None) -> Iterator[str]:
+    """
+    Yield the text of every page of a PDF in page order.
+
+    Pages are split into ranges of PDF_PAGES_PER_TASK and extracted in the
+    process pool; at most ~2 ranges per worker are in flight, so results are
+    streamed back in order without holding the whole document.
+    """
+    if num_pages is None:
+        num_pages = pdf_page_count(path)
+    per_task = max(1, settings.PDF_PAGES_PER_TASK)
+    ranges = deque((start, min(start + per_task, num_pages)) for start in range(0, num_pages, per_task))
+    max_inflight = 2 * _workers()
+    pool = _get_pool()
+    inflight: Deque = deque()
+
+    try:
+        while ranges or inflight:
+            while ranges and len(inflight) < max_inflight:
+                start, end = ranges.popleft()
+                future = pool.submit(
+                    _extract_page_range, path, start, end, settings.PDF_PAGE_TIMEOUT_SECONDS
+                )
+                inflight.append((start, end, future))
+
+            start, end, future = inflight.popleft()
+            try:
+                texts = future.result()
+            except BrokenProcessPool:
+                # a worker died (e.g. OOM); start a fresh pool for the next document
+                shutdown_pool()
+                raise
+            except Exception as e:
+                logger.warning("Failed to extract pages %d-%d of %s: %s", start + 1, end, path, e)
+                texts = [""] * (end - start)
+            yield from texts
+    finally:
+        for _, _, future in inflight:
+            future.cancel()
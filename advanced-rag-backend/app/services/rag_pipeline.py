@@ -1,24 +1,35 @@
 from __future__ import annotations
 
+import asyncio
+import copy
 import os
 import logging
 import time
 import uuid
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
+import httpx
+import numpy as np
 from sqlalchemy.orm import Session
-from groq import Groq  # Import Groq client
+from starlette.concurrency import run_in_threadpool
+from groq import AsyncGroq  # Async Groq client: LLM calls don't hold a thread
 
 from app.core.config import get_settings
 from app.schemas.chat import AgentMode
 from app.services.agents import plan_research_steps, build_rag_prompt
+from app.services.chunk_text import hydrate
+from app.services.context_packing import ContextChunk
 
 # Retrieval imports
-from app.services.embeddings import embed_texts
-# FIX: Import 'search_index' instead of 'search'
-from app.services.faiss_store import search_index as faiss_search
+from app.services.embeddings import embed_queries
+from app.services.faiss_store import search_index_batch as faiss_search_batch
+from app.services.faiss_store import index_version, search_lexical_batch
+from app.services.reranker import rerank_results
 from app.models.document import Document, DocumentChunk
 from app.services.analytics import record_query_analytics
+from app.services.answer_cache import AnswerKey, CachedAnswer, answer_cache, answer_key, semantic_cache
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -27,214 +38,489 @@ settings = get_settings()
 # Groq Setup (Enabled)
 # ----------------------------
 # Ensure GROQ_API_KEY is set in your Render Env Vars
-client = Groq(api_key=settings.GROQ_API_KEY)
+client = AsyncGroq(
+    api_key=settings.GROQ_API_KEY,
+    http_client=httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.LLM_TIMEOUT_SECONDS, connect=5.0),
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_CONNECTIONS // 4,
+        ),
+    ),
+)
 
+# Embedding + FAISS search are CPU-bound; they run here instead of on the
+# event loop (or the shared threadpool that serves sync dependencies).
+_retrieval_executor = ThreadPoolExecutor(
+    max_workers=settings.RETRIEVAL_WORKERS, thread_name_prefix="retrieval"
+)
 
-def _call_llm(prompt: str, mode: AgentMode) -> Tuple[str, Dict[str, int]]:
-    """
-    Real call to Groq LLM.
-    """
+
+LLM_ERROR_MESSAGE = "I'm sorry, I encountered an error connecting to the AI model."
+
+SYSTEM_PROMPT = "You are a helpful AI assistant. Answer strictly based on the provided context."
+
+
+def _model_for(mode: AgentMode) -> str:
     # Select model based on agent_mode
     # Updated to Llama 3.1/3.3 models (Current as of late 2024/2025)
     if mode == AgentMode.research:
-        model_name = "llama-3.3-70b-versatile"  # Smarter, latest model
-    else:
-        model_name = "llama-3.1-8b-instant"     # Extremely fast model
+        return "llama-3.3-70b-versatile"  # Smarter, latest model
+    return "llama-3.1-8b-instant"     # Extremely fast model
+
+
+def _token_budget(mode: AgentMode) -> int:
+    # Context tokens allowed in a prompt for the model serving this mode
+    return settings.CONTEXT_TOKEN_BUDGETS.get(_model_for(mode), settings.CONTEXT_TOKEN_BUDGET)
 
-    try:
-        completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a helpful AI assistant. Answer strictly based on the provided context."
-                },
-                {"role": "user", "content": prompt}
-            ],
-            model=model_name,
-            temperature=0.1,  # Low temp for factual accuracy
-        )
 
-        answer = completion.choices[0].message.content
-        
-        # Safe access to usage stats
-        usage = completion.usage
-        token_usage = {
-            "prompt_tokens": usage.prompt_tokens if usage else 0,
-            "completion_tokens": usage.completion_tokens if usage else 0,
-            "total_tokens": usage.total_tokens if usage else 0
-        }
-        return answer, token_usage
+def _messages(prompt: str) -> List[Dict[str, str]]:
+    return [
+        {
+            "role": "system", 
+            "content": SYSTEM_PROMPT
+        },
+        {"role": "user", "content": prompt}
+    ]
 
+
+def _usage_dict(usage: Any) -> Dict[str, int]:
+    # Safe access to usage stats
+    return {
+        "prompt_tokens": usage.prompt_tokens if usage else 0,
+        "completion_tokens": usage.completion_tokens if usage else 0,
+        "total_tokens": usage.total_tokens if usage else 0
+    }
+
+
+async def _complete(prompt: str, mode: AgentMode) -> Tuple[str, Dict[str, int]]:
+    completion = await client.chat.completions.create(
+        messages=_messages(prompt),
+        model=_model_for(mode),
+        temperature=0.1,  # Low temp for factual accuracy
+    )
+    return completion.choices[0].message.content, _usage_dict(completion.usage)
+
+
+async def _call_llm(prompt: str, mode: AgentMode) -> Tuple[str, Dict[str, int]]:
+    """
+    Real call to Groq LLM.
+    """
+    try:
+        return await _complete(prompt, mode)
     except Exception as e:
         logger.error(f"Groq API call failed: {e}")
-        return "I'm sorry, I encountered an error connecting to the AI model.", {
-            "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0
-        }
+        return LLM_ERROR_MESSAGE, _usage_dict(None)
+
+
+def _add_usage(total: Dict[str, int], usage: Dict[str, int]) -> None:
+    for k in total:
+        total[k] += usage.get(k, 0)
+
+
+async def _stream_llm(
+    prompt: str, mode: AgentMode, token_usage: Dict[str, int]
+) -> AsyncIterator[str]:
+    """
+    Streaming call to Groq LLM: yields answer text as it is generated and
+    adds the final usage (sent on the last chunk) into `token_usage`.
+    """
+    try:
+        stream = await client.chat.completions.create(
+            messages=_messages(prompt),
+            model=_model_for(mode),
+            temperature=0.1,
+            stream=True,
+        )
+        async for chunk in stream:
+            for choice in chunk.choices or []:
+                text = getattr(choice.delta, "content", None)
+                if text:
+                    yield text
+            x_groq = getattr(chunk, "x_groq", None)
+            if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                _add_usage(token_usage, _usage_dict(x_groq.usage))
+
+    except Exception as e:
+        logger.error(f"Groq API streaming call failed: {e}")
+        yield LLM_ERROR_MESSAGE
 
 
 # ----------------------------
 # Retrieval (embeddings + FAISS)
 # ----------------------------
 
-def _retrieve_context(
+def _retrieve_contexts(
     db: Session,
     user_id: Optional[Any],
-    query: str,
+    queries: List[str],
     selected_document_ids: Optional[List[str]] = None,
     top_k: int = 8,
-) -> Tuple[List[str], List[Dict[str, Any]]]:
+    query_vectors: Optional[np.ndarray] = None,
+    min_score: Optional[float] = None,
+) -> Tuple[List[Tuple[List[ContextChunk], List[Dict[str, Any]]]], bool]:
     """
-    Retrieves relevant chunks from the vector DB.
+    Retrieves relevant chunks for several queries at once: one embedding
+    call (skipped if `query_vectors` are passed in) and one FAISS search
+    over the stacked query matrix. Vector hits with a cosine similarity
+    below `min_score` (default RETRIEVAL_MIN_SCORE) are dropped; keyword
+    hits carry no similarity and are not cut. With hybrid
+    search on, BM25 keyword hits are fused in by reciprocal rank; with
+    re-ranking on, a wider candidate set is re-scored by the cross-encoder
+    and only the best RERANK_TOP_K are kept.
+
+    Returns a (context_chunks, sources) pair per query, and whether
+    retrieval completed: False if a step failed and the context is empty
+    or degraded, so the answer built on it must not be cached.
     """
+    empty = [([], []) for _ in queries]
     if not user_id:
-        logger.info("No user_id provided to _retrieve_context; returning empty context.")
-        return [], []
+        logger.info("No user_id provided to _retrieve_contexts; returning empty context.")
+        return empty, True
 
     try:
         uid = uuid.UUID(str(user_id))
     except (ValueError, TypeError):
-        logger.warning(f"Invalid user_id {user_id} passed to _retrieve_context.")
-        return [], []
+        logger.warning(f"Invalid user_id {user_id} passed to _retrieve_contexts.")
+        return empty, True
 
     if selected_document_ids is None:
         selected_document_ids = []
+    if min_score is None:
+        min_score = settings.RETRIEVAL_MIN_SCORE
 
-    # 1) Embed query
-    try:
-        # embed_texts returns a list of vectors, take the first one
-        query_vectors = embed_texts([query])
-        q_vec = query_vectors[0]
-    except Exception as e:
-        logger.warning(f"Failed to embed query: {e}")
-        return [], []
+    # 1) Embed queries
+    q_vecs = query_vectors
+    if q_vecs is None:
+        try:
+            # Repeated queries are served from the query-vector cache
+            q_vecs = embed_queries(queries)
+        except Exception as e:
+            logger.warning(f"Failed to embed query: {e}")
+            return empty, False
+
+    hybrid = settings.HYBRID_SEARCH_ENABLED
+    rerank = settings.RERANK_ENABLED
+    # hits kept for the re-ranker, then fetched from each retriever
+    keep = max(top_k, settings.RERANK_CANDIDATES) if rerank else top_k
+    candidates = max(keep, settings.HYBRID_CANDIDATES) if hybrid else keep
 
     # 2) FAISS search
     try:
-        # We use 'search_index' which is imported as 'faiss_search'
-        faiss_results = faiss_search(
+        # Document scoping happens inside FAISS, so we get the true top-k
+        # within the selection rather than filtering a global top-k
+        faiss_results = faiss_search_batch(
             user_id=str(uid),
-            query_vector=q_vec,
-            top_k=top_k
+            query_vectors=q_vecs,
+            top_k=candidates,
+            document_ids=selected_document_ids or None,
+            min_score=min_score,
         )
     except Exception as e:
         logger.warning(f"FAISS search failed: {e}")
-        return [], []
+        return empty, False
+
+    complete = True
 
-    if not faiss_results:
-        return [], []
+    # 3) Keyword search, for exact identifiers/codes embeddings blur together
+    if hybrid:
+        try:
+            lexical_results = search_lexical_batch(
+                user_id=str(uid),
+                queries=queries,
+                top_k=candidates,
+                document_ids=selected_document_ids or None,
+            )
+            faiss_results = [
+                _fuse_results(vector_hits, keyword_hits, keep)
+                for vector_hits, keyword_hits in zip(faiss_results, lexical_results)
+            ]
+        except Exception as e:
+            logger.warning(f"Lexical search failed, using vector hits only: {e}")
+            faiss_results = [results[:keep] for results in faiss_results]
+            complete = False
+
+    # 4) Chunk text is only stored in the DB: fetch it for all surviving hits at once
+    try:
+        hydrate([res["metadata"] for results in faiss_results for res in results])
+    except Exception as e:
+        logger.warning(f"Failed to load chunk text: {e}")
+        return empty, False
 
-    # 3) Collect chunk IDs and fetch text from DB
-    # faiss_results is a list of dicts: {'score': float, 'metadata': dict}
+    # 5) Cross-encoder re-ranking (time-boxed; falls back to retrieval order)
+    if rerank:
+        faiss_results = rerank_results(queries, faiss_results, min(top_k, settings.RERANK_TOP_K))
+
+    # 6) Collect chunk text + sources
+    # faiss_results holds a list of dicts per query: {'score': float, 'metadata': dict}
     # metadata contains 'chunk_id', 'document_id', 'text', etc.
-    
-    context_chunks: List[str] = []
-    sources: List[Dict[str, Any]] = []
+    return [_context_from_results(results) for results in faiss_results], complete
 
-    # Filter by selected_document_ids if provided
-    # Convert selected_document_ids to set of strings for faster lookup
-    selected_ids_set = set(str(d) for d in selected_document_ids) if selected_document_ids else None
+
+def _fuse_results(
+    vector_hits: List[Dict[str, Any]],
+    keyword_hits: List[Dict[str, Any]],
+    top_k: int,
+) -> List[Dict[str, Any]]:
+    """
+    Reciprocal rank fusion: each hit scores sum(1 / (HYBRID_RRF_K + rank))
+    over the lists it appears in, so the retrievers' incomparable raw scores
+    (cosine similarity or L2 distance, BM25) never have to be calibrated
+    against each other.
+    The fused score replaces the raw one; the vector search's raw score is
+    kept as "vector_score" (None for keyword-only hits).
+    """
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for results in (vector_hits, keyword_hits):
+        for rank, res in enumerate(results, start=1):
+            key = res["metadata"].get("chunk_id")
+            entry = fused.setdefault(key, {"score": 0.0, "vector_score": None, "metadata": res["metadata"]})
+            entry["score"] += 1.0 / (settings.HYBRID_RRF_K + rank)
+            if results is vector_hits:
+                entry["vector_score"] = res["score"]
+    return sorted(fused.values(), key=lambda r: r["score"], reverse=True)[:top_k]
+
+
+def _context_from_results(faiss_results: List[Dict[str, Any]]) -> Tuple[List[ContextChunk], List[Dict[str, Any]]]:
+    context_chunks: List[ContextChunk] = []
+    sources: List[Dict[str, Any]] = []
 
     for res in faiss_results:
         meta = res["metadata"]
         doc_id = meta.get("document_id")
-        
-        # If filtering is active and this doc is not selected, skip
-        if selected_ids_set and str(doc_id) not in selected_ids_set:
-            continue
-            
+
         text = meta.get("text", "")
         if text:
-            context_chunks.append(text)
+            # position is kept so the prompt builder can merge neighbouring chunks
+            context_chunks.append({
+                "text": text,
+                "chunk_id": meta.get("chunk_id"),
+                "document_id": doc_id,
+                "chunk_index": meta.get("chunk_index"),
+            })
             sources.append({
                 "id": meta.get("chunk_id"),
                 "document_id": doc_id,
                 "filename": meta.get("filename", "Unknown"),
                 "snippet": text[:300],
-                "score": res["score"]
+                "score": res["score"],
+                # same as score unless hybrid search replaced it with the RRF score
+                "vector_score": res.get("vector_score", res["score"]),
             })
 
     return context_chunks, sources
 
 
+def _merge_contexts(
+    retrieved: List[Tuple[List[ContextChunk], List[Dict[str, Any]]]],
+    limit: int,
+) -> Tuple[List[ContextChunk], List[Dict[str, Any]]]:
+    """
+    Deduplicate the hits of several queries into one ranked list: ranks are
+    interleaved (every query's 1st hit, then every 2nd, ...), keeping the
+    first occurrence of each chunk, up to `limit`.
+    """
+    context_chunks: List[ContextChunk] = []
+    sources: List[Dict[str, Any]] = []
+    seen = set()
+    depth = max((len(chunks) for chunks, _ in retrieved), default=0)
+    for rank in range(depth):
+        for chunks, srcs in retrieved:
+            if rank >= len(chunks) or srcs[rank]["id"] in seen:
+                continue
+            seen.add(srcs[rank]["id"])
+            context_chunks.append(chunks[rank])
+            sources.append(srcs[rank])
+            if len(sources) >= limit:
+                return context_chunks, sources
+    return context_chunks, sources
+
+
 # ----------------------------
 # Main RAG entry point
 # ----------------------------
 
-def run_rag_query(
+def _normalize_mode(agent_mode: Any) -> AgentMode:
+    if isinstance(agent_mode, str):
+        try:
+            return AgentMode(agent_mode)
+        except ValueError:
+            return AgentMode.default
+    return agent_mode
+
+
+def _request_queries(query: str, agent_mode: AgentMode) -> List[str]:
+    # The query, then the planned sub-questions in research mode
+    steps = plan_research_steps(query) if agent_mode == AgentMode.research else []
+    return [query, *steps]
+
+
+async def _embed_request(queries: List[str]) -> Optional[np.ndarray]:
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_retrieval_executor, embed_queries, queries)
+    except Exception as e:
+        logger.warning(f"Failed to embed query: {e}")
+        return None
+
+
+async def _retrieve(
     db: Session,
     user_id: Optional[str],
     query: str,
     agent_mode: AgentMode,
-    selected_document_ids: Optional[List[str]] = None,
-) -> Tuple[str, List[Dict[str, Any]], Dict[str, int], float]:
+    selected_document_ids: Optional[List[str]],
+    top_k: int = 8,
+    query_vectors: Optional[np.ndarray] = None,
+) -> Tuple[List[ContextChunk], List[Dict[str, Any]], List[Tuple[str, List[ContextChunk]]], bool]:
     """
-    Core RAG pipeline.
+    Retrieval for a request, off the event loop. Returns the context chunks
+    and sources for the answer, plus (sub-question, its own context chunks)
+    for each research step, and whether retrieval completed (see
+    _retrieve_contexts). The query and all sub-questions are retrieved
+    in one batch; research sources are the merged, deduplicated hits.
+    `query_vectors`, if given, are the embeddings of _request_queries().
     """
-    start = time.perf_counter()
+    queries = _request_queries(query, agent_mode)
+    steps = queries[1:]
+    loop = asyncio.get_running_loop()
+    retrieved, complete = await loop.run_in_executor(
+        _retrieval_executor,
+        partial(
+            _retrieve_contexts,
+            db=db,
+            user_id=user_id,
+            queries=queries,
+            selected_document_ids=selected_document_ids or [],
+            top_k=top_k,
+            query_vectors=query_vectors,
+        ),
+    )
+    if not steps:
+        context_chunks, sources = retrieved[0]
+        return context_chunks, sources, [], complete
 
-    # Normalize agent_mode
-    if isinstance(agent_mode, str):
+    context_chunks, sources = _merge_contexts(retrieved, limit=top_k)
+    research_steps = [(step, chunks) for step, (chunks, _) in zip(steps, retrieved[1:])]
+    return context_chunks, sources, research_steps, complete
+
+
+async def _answer_research_step(
+    index: int,
+    step: str,
+    step_context: List[ContextChunk],
+    agent_mode: AgentMode,
+    semaphore: asyncio.Semaphore,
+) -> Tuple[int, str, Optional[str], Dict[str, int]]:
+    """
+    Answer one research sub-question; the answer is None if the call failed
+    or ran past RESEARCH_STEP_TIMEOUT_SECONDS.
+    """
+    step_prompt = build_rag_prompt(step, step_context, agent_mode, _token_budget(agent_mode))
+    async with semaphore:
         try:
-            agent_mode = AgentMode(agent_mode)
-        except ValueError:
-            agent_mode = AgentMode.default
+            answer, usage = await asyncio.wait_for(
+                _complete(step_prompt, agent_mode),
+                timeout=settings.RESEARCH_STEP_TIMEOUT_SECONDS,
+            )
+            return index, step, answer, usage
+        except asyncio.TimeoutError:
+            logger.warning(f"Research step {index + 1} timed out: {step!r}")
+        except Exception as e:
+            logger.warning(f"Research step {index + 1} failed: {e}")
+    return index, step, None, _usage_dict(None)
+
+
+async def _iter_research_steps(
+    research_steps: List[Tuple[str, List[ContextChunk]]],
+    agent_mode: AgentMode,
+) -> AsyncIterator[Tuple[int, str, Optional[str], Dict[str, int]]]:
+    """
+    Run all planned sub-questions, each over its own retrieved context,
+    concurrently (at most RESEARCH_CONCURRENCY at a time), yielding
+    (index, step, answer, usage) as each one finishes.
+    """
+    semaphore = asyncio.Semaphore(max(1, settings.RESEARCH_CONCURRENCY))
+    tasks = [
+        asyncio.ensure_future(_answer_research_step(i, step, step_context, agent_mode, semaphore))
+        for i, (step, step_context) in enumerate(research_steps)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # e.g. the client went away mid-stream
+        for task in tasks:
+            task.cancel()
 
-    if selected_document_ids is None:
-        selected_document_ids = []
 
-    # 1) Retrieval
-    context_chunks, sources = _retrieve_context(
-        db=db,
-        user_id=user_id,
-        query=query,
-        selected_document_ids=selected_document_ids,
-        top_k=8,
+def _synthesis_prompt(
+    query: str,
+    context_chunks: List[ContextChunk],
+    agent_mode: AgentMode,
+    results: List[Tuple[str, Optional[str]]],
+) -> str:
+    """
+    Prompt combining the (step, answer) results, in plan order; failed steps
+    are left out.
+    """
+    sub_answers = [
+        f"Sub-question: {step}\nAnswer: {answer}\n" for step, answer in results if answer is not None
+    ]
+    if not sub_answers:
+        # Every sub-question failed: answer the question directly instead
+        return build_rag_prompt(query, context_chunks, agent_mode, _token_budget(agent_mode))
+
+    return (
+        "Combine these sub-answers into a coherent final answer:\n"
+        f"{chr(10).join(sub_answers)}"
     )
 
-    token_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
 
-    # 2) Agent Logic
+async def _final_prompt(
+    query: str,
+    context_chunks: List[ContextChunk],
+    agent_mode: AgentMode,
+    token_usage: Dict[str, int],
+    research_steps: List[Tuple[str, List[ContextChunk]]],
+) -> str:
+    """
+    Prompt for the call that produces the user-facing answer. Research mode
+    first answers the planned sub-questions concurrently (usage added to
+    `token_usage`) and asks for a synthesis of those.
+    """
     if agent_mode == AgentMode.research:
-        steps = plan_research_steps(query)
-        sub_answers = []
-        for step in steps:
-            step_prompt = build_rag_prompt(step, context_chunks, agent_mode)
-            step_answer, step_usage = _call_llm(step_prompt, agent_mode)
-            sub_answers.append(f"Sub-question: {step}\nAnswer: {step_answer}\n")
-            
-            # Sum usage
-            for k in token_usage:
-                token_usage[k] += step_usage.get(k, 0)
-
-        synth_prompt = (
-            "Combine these sub-answers into a coherent final answer:\n"
-            f"{chr(10).join(sub_answers)}"
-        )
-        answer, synth_usage = _call_llm(synth_prompt, agent_mode)
-        for k in token_usage:
-            token_usage[k] += synth_usage.get(k, 0)
+        results: Dict[int, Tuple[str, Optional[str]]] = {}
+        async for index, step, answer, step_usage in _iter_research_steps(research_steps, agent_mode):
+            _add_usage(token_usage, step_usage)
+            results[index] = (step, answer)
+        return _synthesis_prompt(query, context_chunks, agent_mode, [results[i] for i in sorted(results)])
 
-    elif agent_mode == AgentMode.summarizer:
+    if agent_mode == AgentMode.summarizer:
         summary_query = f"Summarize the following context for: {query}"
-        prompt = build_rag_prompt(summary_query, context_chunks, agent_mode)
-        answer, token_usage = _call_llm(prompt, agent_mode)
+        return build_rag_prompt(summary_query, context_chunks, agent_mode, _token_budget(agent_mode))
 
-    elif agent_mode == AgentMode.brainstorm:
+    if agent_mode == AgentMode.brainstorm:
         brainstorm_query = f"Brainstorm ideas based on context for: {query}"
-        prompt = build_rag_prompt(brainstorm_query, context_chunks, agent_mode)
-        answer, token_usage = _call_llm(prompt, agent_mode)
+        return build_rag_prompt(brainstorm_query, context_chunks, agent_mode, _token_budget(agent_mode))
 
-    else:
-        # Standard RAG
-        prompt = build_rag_prompt(query, context_chunks, agent_mode)
-        answer, token_usage = _call_llm(prompt, agent_mode)
+    # Standard RAG
+    return build_rag_prompt(query, context_chunks, agent_mode, _token_budget(agent_mode))
 
-    latency_ms = (time.perf_counter() - start) * 1000.0
 
-    # 3) Analytics
+async def _record_analytics(
+    db: Session,
+    user_id: Optional[str],
+    query: str,
+    agent_mode: AgentMode,
+    sources: List[Dict[str, Any]],
+    latency_ms: float,
+    token_usage: Dict[str, int],
+) -> None:
     try:
         doc_ids = list({src["document_id"] for src in sources if "document_id" in src})
-        record_query_analytics(
+        await run_in_threadpool(
+            record_query_analytics,
             db=db,
             user_id=user_id or "",
             query=query,
@@ -246,4 +532,293 @@ def run_rag_query(
     except Exception as e:
         logger.warning(f"Failed to record analytics: {e}")
 
+
+def _request_key(
+    user_id: Optional[str],
+    query: str,
+    agent_mode: AgentMode,
+    selected_document_ids: Optional[List[str]],
+) -> Optional[AnswerKey]:
+    # Identifies requests that must get the same answer (answer caches, single-flight)
+    if not user_id:
+        return None
+    return answer_key(user_id, query, agent_mode.value, selected_document_ids, index_version(user_id))
+
+
+def _no_usage() -> Dict[str, int]:
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+
+async def _cached_answer(
+    user_id: Optional[str],
+    query: str,
+    agent_mode: AgentMode,
+    selected_document_ids: Optional[List[str]],
+) -> Tuple[Optional[AnswerKey], Optional[np.ndarray], Optional[CachedAnswer]]:
+    """
+    Look the request up in the exact answer cache, then in the semantic
+    cache. Returns (cache key, query vectors, cached answer or None); the
+    vectors of the request's queries are reused by retrieval on a miss.
+
+    The exact lookup comes after the (awaited) embedding, so a miss here
+    and the caller's single-flight registration happen without yielding to
+    the event loop: an identical request finishing in between can't be
+    missed both ways. Repeated queries embed from the query-vector cache.
+    """
+    cache_key = _request_key(user_id, query, agent_mode, selected_document_ids)
+    if cache_key is None:
+        return None, None, None
+
+    query_vectors = None
+    if settings.SEMANTIC_CACHE_ENABLED:
+        query_vectors = await _embed_request(_request_queries(query, agent_mode))
+
+    cached = answer_cache.get(cache_key) if settings.ANSWER_CACHE_ENABLED else None
+    if cached is None and query_vectors is not None:
+        cached = semantic_cache.get(cache_key, query_vectors[0])
+    return cache_key, query_vectors, cached
+
+
+def _remember_answer(
+    cache_key: Optional[AnswerKey],
+    query_vectors: Optional[np.ndarray],
+    answer: str,
+    sources: List[Dict[str, Any]],
+) -> None:
+    if cache_key is None:
+        return
+    if settings.ANSWER_CACHE_ENABLED:
+        answer_cache.put(cache_key, answer, sources)
+    if settings.SEMANTIC_CACHE_ENABLED and query_vectors is not None:
+        semantic_cache.put(cache_key, query_vectors[0], answer, sources)
+
+
+# Answers being generated right now, by request key (one event loop per
+# worker, so a plain dict is enough)
+_inflight: Dict[AnswerKey, "asyncio.Future[Tuple[str, List[Dict[str, Any]], Dict[str, int]]]"] = {}
+
+
+async def _single_flight(
+    cache_key: Optional[AnswerKey],
+    generate: Callable[[], Awaitable[Tuple[str, List[Dict[str, Any]], Dict[str, int]]]],
+) -> Tuple[Tuple[str, List[Dict[str, Any]], Dict[str, int]], bool]:
+    """
+    Run `generate()` unless an identical request is already generating, in
+    which case wait for that one's result instead. Returns (result, whether
+    this caller ran it).
+
+    The work runs as its own task, so a leader whose client disconnects
+    doesn't cancel it for the requests waiting on it.
+    """
+    if cache_key is None or not settings.SINGLE_FLIGHT_ENABLED:
+        return await generate(), True
+
+    task, leader = _start_flight(cache_key, generate)
+    return await asyncio.shield(task), leader
+
+
+def _start_flight(
+    cache_key: AnswerKey,
+    generate: Callable[[], Awaitable[Tuple[str, List[Dict[str, Any]], Dict[str, int]]]],
+) -> Tuple["asyncio.Future[Tuple[str, List[Dict[str, Any]], Dict[str, int]]]", bool]:
+    """
+    The in-flight generation for `cache_key`, started as a task from
+    `generate()` and registered if there is none yet; also returns whether
+    it was started here. Doesn't yield to the event loop.
+    """
+    task = _inflight.get(cache_key)
+    if task is not None:
+        logger.info("Joining in-flight generation of an identical request")
+        return task, False
+    task = asyncio.ensure_future(generate())
+    _inflight[cache_key] = task
+    task.add_done_callback(lambda done: _inflight.pop(cache_key, None) if _inflight.get(cache_key) is done else None)
+    return task, True
+
+
+async def _generate_answer(
+    user_id: Optional[str],
+    query: str,
+    agent_mode: AgentMode,
+    selected_document_ids: Optional[List[str]],
+    cache_key: Optional[AnswerKey],
+    query_vectors: Optional[np.ndarray],
+) -> Tuple[str, List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Retrieval + agent logic + LLM call for one request: (answer, sources,
+    token usage). Answers are added to the answer caches unless retrieval
+    or the LLM call failed.
+    """
+    # 1) Retrieval (the DB session isn't needed, so none is held here)
+    context_chunks, sources, research_steps, complete = await _retrieve(
+        None, user_id, query, agent_mode, selected_document_ids, query_vectors=query_vectors
+    )
+
+    # 2) Agent Logic
+    token_usage = _no_usage()
+    prompt = await _final_prompt(query, context_chunks, agent_mode, token_usage, research_steps)
+    answer, answer_usage = await _call_llm(prompt, agent_mode)
+    _add_usage(token_usage, answer_usage)
+
+    if complete and answer != LLM_ERROR_MESSAGE:
+        _remember_answer(cache_key, query_vectors, answer, sources)
+    return answer, sources, token_usage
+
+
+async def run_rag_query(
+    db: Session,
+    user_id: Optional[str],
+    query: str,
+    agent_mode: AgentMode,
+    selected_document_ids: Optional[List[str]] = None,
+) -> Tuple[str, List[Dict[str, Any]], Dict[str, int], float]:
+    """
+    Core RAG pipeline (async: the event loop only waits on the LLM while
+    retrieval and DB writes run in threads).
+    """
+    start = time.perf_counter()
+    agent_mode = _normalize_mode(agent_mode)
+
+    # 0) Same (or paraphrased) question over the same corpus: serve the previous answer
+    cache_key, query_vectors, cached = await _cached_answer(user_id, query, agent_mode, selected_document_ids)
+    if cached is not None:
+        answer, sources = cached
+        token_usage = _no_usage()
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        await _record_analytics(db, user_id, query, agent_mode, sources, latency_ms, token_usage)
+        return answer, sources, token_usage, latency_ms
+
+    # 1-2) Retrieval, agent logic and the LLM call, shared with any
+    # identical request already in flight
+    (answer, sources, token_usage), leader = await _single_flight(
+        cache_key,
+        partial(_generate_answer, user_id, query, agent_mode, selected_document_ids, cache_key, query_vectors),
+    )
+    if not leader:
+        # the tokens were spent (and recorded) by the request we waited on
+        sources, token_usage = copy.deepcopy(sources), _no_usage()
+
+    latency_ms = (time.perf_counter() - start) * 1000.0
+
+    # 3) Analytics
+    await _record_analytics(db, user_id, query, agent_mode, sources, latency_ms, token_usage)
+
     return answer, sources, token_usage, latency_ms
+
+
+async def _stream_answer(
+    user_id: Optional[str],
+    query: str,
+    agent_mode: AgentMode,
+    selected_document_ids: Optional[List[str]],
+    cache_key: Optional[AnswerKey],
+    query_vectors: Optional[np.ndarray],
+    emit: Callable[[str, Dict[str, Any]], None],
+) -> Tuple[str, List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Streaming counterpart of _generate_answer: passes the "sources",
+    "sub_answer" and "token" events to `emit` as they happen and returns
+    (answer, sources, token usage) like _generate_answer, so requests
+    joining it get the same result as a /chat/query leader's.
+    """
+    context_chunks, sources, research_steps, complete = await _retrieve(
+        None, user_id, query, agent_mode, selected_document_ids, query_vectors=query_vectors
+    )
+    emit("sources", {"sources": sources})
+
+    token_usage = _no_usage()
+    if agent_mode == AgentMode.research:
+        results: Dict[int, Tuple[str, Optional[str]]] = {}
+        async for index, step, answer, step_usage in _iter_research_steps(research_steps, agent_mode):
+            _add_usage(token_usage, step_usage)
+            results[index] = (step, answer)
+            if settings.RESEARCH_STREAM_SUB_ANSWERS:
+                emit("sub_answer", {"index": index, "question": step, "answer": answer, "ok": answer is not None})
+        prompt = _synthesis_prompt(query, context_chunks, agent_mode, [results[i] for i in sorted(results)])
+    else:
+        prompt = await _final_prompt(query, context_chunks, agent_mode, token_usage, research_steps)
+
+    pieces: List[str] = []
+    async for text in _stream_llm(prompt, agent_mode, token_usage):
+        pieces.append(text)
+        emit("token", {"text": text})
+
+    answer = "".join(pieces)
+    if complete and LLM_ERROR_MESSAGE not in pieces:
+        _remember_answer(cache_key, query_vectors, answer, sources)
+    return answer, sources, token_usage
+
+
+async def stream_rag_query(
+    db: Session,
+    user_id: Optional[str],
+    query: str,
+    agent_mode: AgentMode,
+    selected_document_ids: Optional[List[str]] = None,
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Streaming variant of run_rag_query yielding (event, payload) pairs:
+    "sources" once retrieval is done, in research mode a "sub_answer" per
+    sub-question as it finishes (if RESEARCH_STREAM_SUB_ANSWERS), "token"
+    per answer fragment, then "done" with token usage and latency.
+    Analytics are recorded at the end.
+
+    The generation is registered for single-flight like a /chat/query one
+    and keeps running if this client disconnects. A cached answer, or the
+    result of an identical request already in flight (streamed or not), is
+    replayed as a single "token" event.
+    """
+    start = time.perf_counter()
+    agent_mode = _normalize_mode(agent_mode)
+
+    cache_key, query_vectors, cached = await _cached_answer(user_id, query, agent_mode, selected_document_ids)
+    if cached is not None:
+        answer, sources = cached
+        token_usage = _no_usage()
+    else:
+        events: "asyncio.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = asyncio.Queue()
+        generate = partial(
+            _stream_answer, user_id, query, agent_mode, selected_document_ids, cache_key, query_vectors,
+            lambda event, payload: events.put_nowait((event, payload)),
+        )
+        shared = cache_key is not None and settings.SINGLE_FLIGHT_ENABLED
+        if shared:
+            task, leader = _start_flight(cache_key, generate)
+        else:
+            task, leader = asyncio.ensure_future(generate()), True
+
+        if leader:
+            task.add_done_callback(lambda _: events.put_nowait(None))
+            try:
+                while True:
+                    item = await events.get()
+                    if item is None:
+                        break
+                    yield item
+            finally:
+                # nobody else can be waiting on an unregistered generation
+                if not shared:
+                    task.cancel()
+            answer, sources, token_usage = task.result()
+            latency_ms = (time.perf_counter() - start) * 1000.0
+            await _record_analytics(db, user_id, query, agent_mode, sources, latency_ms, token_usage)
+            yield "done", {
+                "used_agent_mode": agent_mode.value,
+                "token_usage": token_usage,
+                "latency_ms": latency_ms,
+            }
+            return
+
+        answer, sources, _ = await asyncio.shield(task)
+        # the tokens were spent (and recorded) by the request we waited on
+        sources, token_usage = copy.deepcopy(sources), _no_usage()
+
+    yield "sources", {"sources": sources}
+    yield "token", {"text": answer}
+    latency_ms = (time.perf_counter() - start) * 1000.0
+    await _record_analytics(db, user_id, query, agent_mode, sources, latency_ms, token_usage)
+    yield "done", {
+        "used_agent_mode": agent_mode.value,
+        "token_usage": token_usage,
+        "latency_ms": latency_ms,
+    }
@@ -0,0 +1,100 @@
+# app/services/reranker.py
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from fastembed.rerank.cross_encoder import TextCrossEncoder
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_model: Optional[TextCrossEncoder] = None
+_loader: Optional[threading.Thread] = None
+_loader_lock = threading.Lock()
+
+
+def _load_model() -> None:
+    global _model
+    try:
+        # Small ONNX cross-encoder, runs on CPU like the embedding model
+        _model = TextCrossEncoder(model_name=settings.RERANK_MODEL)
+        logger.info(f"Loaded re-ranking model {settings.RERANK_MODEL}")
+    except Exception as e:
+        logger.warning(f"Could not load re-ranking model {settings.RERANK_MODEL}, re-ranking disabled: {e}")
+
+
+def warm_up() -> None:
+    """
+    Start loading the cross-encoder in the background (once), so no query
+    waits for it; until it is ready results keep retrieval order.
+    """
+    global _loader
+    if not settings.RERANK_ENABLED:
+        return
+    with _loader_lock:
+        if _loader is None:
+            _loader = threading.Thread(target=_load_model, name="rerank-warmup", daemon=True)
+            _loader.start()
+
+
+def rerank_results(
+    queries: List[str],
+    results_per_query: List[List[Dict[str, Any]]],
+    top_k: int,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Re-order each query's candidates by cross-encoder relevance and keep the
+    top_k.
+
+    (query, chunk) pairs of all queries are scored in batches of
+    RERANK_BATCH_SIZE, best-ranked candidates first. Once RERANK_BUDGET_MS
+    is spent no further batches are started: candidates scored so far are
+    re-ordered, the rest keep their retrieval order behind them.
+    """
+    model = _model
+    if model is None:
+        # still loading, or unavailable
+        warm_up()
+        return [results[:top_k] for results in results_per_query]
+
+    # (query index, candidate index), interleaved by rank across queries
+    depth = max((len(results) for results in results_per_query), default=0)
+    order = [
+        (qi, rank)
+        for rank in range(depth)
+        for qi, results in enumerate(results_per_query)
+        if rank < len(results)
+    ]
+
+    scores: Dict[tuple, float] = {}
+    deadline = time.perf_counter() + settings.RERANK_BUDGET_MS / 1000.0
+    batch_size = max(1, settings.RERANK_BATCH_SIZE)
+    try:
+        for start in range(0, len(order), batch_size):
+            if time.perf_counter() >= deadline:
+                logger.info(f"Re-ranking budget spent after {len(scores)}/{len(order)} candidates")
+                break
+            batch = order[start:start + batch_size]
+            pairs = [
+                (queries[qi], results_per_query[qi][rank]["metadata"].get("text", ""))
+                for qi, rank in batch
+            ]
+            batch_scores = list(model.rerank_pairs(pairs, batch_size=batch_size))
+            scores.update(zip(batch, batch_scores))
+    except Exception as e:
+        logger.warning(f"Re-ranking failed, keeping retrieval order: {e}")
+        return [results[:top_k] for results in results_per_query]
+
+    reranked = []
+    for qi, results in enumerate(results_per_query):
+        scored = [rank for rank in range(len(results)) if (qi, rank) in scores]
+        scored.sort(key=lambda rank: scores[(qi, rank)], reverse=True)
+        unscored = [rank for rank in range(len(results)) if (qi, rank) not in scores]
+        reranked.append([results[rank] for rank in scored + unscored][:top_k])
+    return reranked
@@ -0,0 +1,31 @@
+import os
+import unittest
+
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+from app.services.context_packing import pack_context
+
+
+def _chunk(chunk_id, index, text, document_id="doc"):
+    return {"text": text, "chunk_id": chunk_id, "document_id": document_id, "chunk_index": index}
+
+
+class PackContextTest(unittest.TestCase):
+    def test_distinct_chunks_at_the_same_position_are_all_kept(self):
+        # Rows migrated from old indexes carry no real position
+        for index in (0, -1):
+            chunks = [_chunk(f"c{i}", index, f"distinct chunk {i} text") for i in range(5)]
+            self.assertEqual(pack_context(chunks), [f"distinct chunk {i} text" for i in range(5)])
+
+    def test_same_chunk_retrieved_twice_is_packed_once(self):
+        chunks = [_chunk("c1", 3, "some chunk text"), _chunk("c1", 3, "some chunk text")]
+        self.assertEqual(pack_context(chunks), ["some chunk text"])
+
+    def test_adjacent_chunks_are_joined_without_their_overlap(self):
+        shared = "x" * 40
+        chunks = [_chunk("c1", 0, "first part " + shared), _chunk("c2", 1, shared + " second part")]
+        self.assertEqual(pack_context(chunks), ["first part " + shared + " second part"])
+
+
+if __name__ == "__main__":
+    unittest.main()
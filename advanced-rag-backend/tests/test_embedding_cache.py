@@ -0,0 +1,69 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+import numpy as np
+
+from app.services import embedding_cache
+from app.services.embedding_cache import EmbeddingCache, text_digest
+
+
+class EmbeddingCachePruneTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.work_dir, "cache.sqlite3")
+        self.now = 1_000_000
+        patcher = mock.patch.object(embedding_cache.time, "time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _put(self, cache, texts):
+        digests = [text_digest(t) for t in texts]
+        cache.put_many("m", digests, np.ones((len(texts), 4), dtype="float32"))
+        return digests
+
+    def test_least_recently_used_rows_are_pruned(self):
+        with mock.patch.object(embedding_cache, "_PRUNE_EVERY", 1):
+            cache = EmbeddingCache(self.path, hot_entries=0, max_rows=3)
+            old = self._put(cache, ["a", "b", "c"])
+            self.now += 2 * embedding_cache._TOUCH_SECONDS
+            cache.get_many("m", old[:1])  # "a" is used again
+            self.now += 1
+            self._put(cache, ["d", "e"])
+
+        found = cache.get_many("m", [text_digest(t) for t in ["a", "b", "c", "d", "e"]])
+        self.assertEqual([v is not None for v in found], [True, False, False, True, True])
+        self.assertEqual(cache.stats()["pruned"], 2)
+
+    def test_file_without_last_used_is_migrated(self):
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE embeddings (model TEXT NOT NULL, digest BLOB NOT NULL,"
+                " vector BLOB NOT NULL, PRIMARY KEY (model, digest)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "INSERT INTO embeddings VALUES (?, ?, ?)",
+                ("m", text_digest("old"), np.ones(4, dtype=np.float16).tobytes()),
+            )
+        conn.close()
+
+        cache = EmbeddingCache(self.path, hot_entries=0, max_rows=1)
+        with sqlite3.connect(self.path) as conn:
+            self.assertEqual(conn.execute("SELECT last_used FROM embeddings").fetchall(), [(0,)])
+        conn.close()
+        with mock.patch.object(embedding_cache, "_PRUNE_EVERY", 1):
+            self._put(cache, ["new"])
+        found = cache.get_many("m", [text_digest("old"), text_digest("new")])
+        self.assertEqual([v is not None for v in found], [False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
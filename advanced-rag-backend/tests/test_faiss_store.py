@@ -0,0 +1,132 @@
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+import numpy as np
+
+from app.services import faiss_store
+from app.services.chunk_store import ChunkStore
+from app.services.index_factory import DIMENSION
+
+
+def _upload(user_id, n, rng):
+    document_id = str(uuid.uuid4())
+    vectors = rng.normal(size=(n, DIMENSION)).astype("float32")
+    metadatas = [
+        {"chunk_id": str(uuid.uuid4()), "document_id": document_id, "chunk_index": i, "filename": "f.txt", "text": f"chunk {i}"}
+        for i in range(n)
+    ]
+    faiss_store.add_embeddings(user_id, vectors, metadatas)
+    return document_id, vectors
+
+
+class FaissStoreReloadTest(unittest.TestCase):
+    def setUp(self):
+        self.indices_dir = tempfile.mkdtemp()
+        self._saved_dir = faiss_store.INDICES_DIR
+        faiss_store.INDICES_DIR = self.indices_dir
+        faiss_store.indices.clear()
+        self.rng = np.random.default_rng(0)
+        self.user_id = str(uuid.uuid4())
+
+    def tearDown(self):
+        faiss_store.indices.clear()
+        faiss_store.INDICES_DIR = self._saved_dir
+        shutil.rmtree(self.indices_dir, ignore_errors=True)
+
+    def test_reload_before_first_compaction_replays_segments(self):
+        uploads = [_upload(self.user_id, 3, self.rng) for _ in range(3)]
+        self.assertLess(3, faiss_store.COMPACT_AFTER_SEGMENTS)
+        self.assertFalse(os.path.exists(faiss_store._get_manifest_path(self.user_id)))
+
+        faiss_store.indices.clear()
+        user_data = faiss_store.load_user_index(self.user_id)
+        self.assertEqual(user_data["index"].ntotal, 9)
+        self.assertEqual(user_data["next_id"], 9)
+
+        # A later upload gets fresh IDs, and every hit resolves to its own document
+        uploads.append(_upload(self.user_id, 3, self.rng))
+        self.assertEqual(len(user_data["store"]), 12)
+        for document_id, vectors in uploads:
+            hits = faiss_store.search_index_batch(self.user_id, vectors, top_k=1)
+            self.assertEqual([h[0]["metadata"]["document_id"] for h in hits], [document_id] * 3)
+
+    def test_failed_segment_write_leaves_no_chunk_rows(self):
+        first, _ = _upload(self.user_id, 3, self.rng)
+        with mock.patch.object(faiss_store, "_atomic_write", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                _upload(self.user_id, 3, self.rng)
+        self.assertEqual(len(faiss_store.load_user_index(self.user_id)["store"]), 3)
+
+        second, vectors = _upload(self.user_id, 3, self.rng)
+        hits = faiss_store.search_index_batch(self.user_id, vectors, top_k=1)
+        self.assertEqual([h[0]["metadata"]["document_id"] for h in hits], [second] * 3)
+
+    def test_reload_drops_rows_of_unwritten_segments(self):
+        _upload(self.user_id, 3, self.rng)
+        store = faiss_store.load_user_index(self.user_id)["store"]
+        # As if the process died between the chunk rows and the segment
+        orphan = [{"chunk_id": str(uuid.uuid4()), "document_id": str(uuid.uuid4()), "chunk_index": 0}]
+        store.append(np.array([3], dtype="int64"), orphan)
+
+        faiss_store.indices.clear()
+        user_data = faiss_store.load_user_index(self.user_id)
+        self.assertEqual(len(user_data["store"]), 3)
+
+        document_id, vectors = _upload(self.user_id, 3, self.rng)
+        hits = faiss_store.search_index_batch(self.user_id, vectors, top_k=1)
+        self.assertEqual([h[0]["metadata"]["document_id"] for h in hits], [document_id] * 3)
+
+    def test_chunk_store_cuts_rows_with_out_of_order_ids(self):
+        directory = os.path.join(self.indices_dir, "store")
+        store = ChunkStore(directory)
+        rows = [{"chunk_id": str(uuid.uuid4()), "document_id": str(uuid.uuid4()), "chunk_index": 0} for _ in range(4)]
+        store.append(np.array([0, 1], dtype="int64"), rows[:2])
+        store.append(np.array([1, 2], dtype="int64"), rows[2:])
+
+        reopened = ChunkStore(directory)
+        self.assertEqual(reopened.ids.tolist(), [0, 1])
+        self.assertEqual(reopened.get([1])[0]["chunk_id"], rows[1]["chunk_id"])
+
+    def test_index_version_changes_with_documents_only(self):
+        seen = [faiss_store.index_version(self.user_id)]
+        document_id, _ = _upload(self.user_id, 3, self.rng)
+        seen.append(faiss_store.index_version(self.user_id))
+
+        faiss_store.save_user_index(self.user_id)
+        self.assertEqual(faiss_store.index_version(self.user_id), seen[-1])
+
+        faiss_store.remove_document(self.user_id, document_id)
+        seen.append(faiss_store.index_version(self.user_id))
+        faiss_store.clear_user_index(self.user_id)
+        seen.append(faiss_store.index_version(self.user_id))
+        # A fresh index after a wipe doesn't bring back an earlier version
+        _upload(self.user_id, 3, self.rng)
+        seen.append(faiss_store.index_version(self.user_id))
+        self.assertEqual(len(set(seen)), len(seen))
+
+    def test_user_locks_are_dropped_once_released(self):
+        document_id, vectors = _upload(self.user_id, 3, self.rng)
+        faiss_store.search_index_batch(self.user_id, vectors, top_k=1)
+        faiss_store.remove_document(self.user_id, document_id)
+        faiss_store.indices.clear()
+
+        gc.collect()
+        self.assertNotIn(self.user_id, faiss_store._user_locks)
+        self.assertNotIn(self.user_id, faiss_store._search_locks)
+
+    def test_held_user_lock_is_shared(self):
+        held = faiss_store._user_lock(self.user_id)
+        with held:
+            gc.collect()
+            self.assertIs(faiss_store._user_lock(self.user_id), held)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.models.analytics  # noqa: F401  (registers tables)
+import app.models.user  # noqa: F401
+from app.core.db import Base
+from app.models.document import Document, DocumentChunk
+from app.models.ingestion import IngestionJob
+from app.services import faiss_store, ingestion
+from app.services.index_factory import DIMENSION
+
+
+def _fake_embed(texts, use_cache=True):
+    rng = np.random.default_rng(len(texts))
+    return rng.normal(size=(len(texts), DIMENSION)).astype("float32")
+
+
+class IngestionFailureTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        engine = create_engine(
+            f"sqlite:///{os.path.join(self.work_dir, 'test.db')}",
+            connect_args={"check_same_thread": False},
+            future=True,
+        )
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        self._saved_dir = faiss_store.INDICES_DIR
+        faiss_store.INDICES_DIR = os.path.join(self.work_dir, "indices")
+        faiss_store.indices.clear()
+
+        self.user_id = uuid.uuid4()
+        db = self.Session()
+        doc = Document(
+            user_id=self.user_id,
+            filename="big.pdf",
+            stored_path=os.path.join(self.work_dir, "big.pdf"),
+            size_bytes=1,
+            content_type="application/pdf",
+        )
+        db.add(doc)
+        db.flush()
+        job = ingestion.enqueue_ingestion(db, doc)
+        job.status = "running"
+        db.commit()
+        self.doc_id, self.job_id = doc.id, job.id
+        db.close()
+
+    def tearDown(self):
+        faiss_store.indices.clear()
+        faiss_store.INDICES_DIR = self._saved_dir
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _run(self, pages):
+        with mock.patch.object(ingestion, "SessionLocal", self.Session), \
+                mock.patch.object(ingestion, "embed_texts", _fake_embed), \
+                mock.patch.object(ingestion, "pdf_page_count", return_value=50), \
+                mock.patch.object(ingestion, "iter_pdf_pages", return_value=pages), \
+                mock.patch.object(ingestion.settings, "INGEST_BATCH_SIZE", 2), \
+                mock.patch.object(ingestion, "_inflight", 1):
+            ingestion._execute(self.job_id)
+
+    def test_mid_stream_extraction_failure_fails_the_job(self):
+        def pages():
+            yield "First page. " * 200
+            yield "Second page. " * 200
+            raise RuntimeError("extraction pool died")
+
+        with self.assertLogs(ingestion.logger, level="ERROR"):
+            self._run(pages())
+
+        db = self.Session()
+        job = db.get(IngestionJob, self.job_id)
+        self.assertEqual(job.status, "failed")
+        self.assertIn("extraction pool died", job.error)
+        self.assertEqual(db.query(DocumentChunk).filter(DocumentChunk.document_id == self.doc_id).count(), 0)
+        db.close()
+        self.assertEqual(faiss_store.get_index_info(str(self.user_id))["vectors"], 0)
+
+    def test_complete_extraction_succeeds(self):
+        self._run(iter(["First page. " * 200, "Second page. " * 200]))
+
+        db = self.Session()
+        job = db.get(IngestionJob, self.job_id)
+        self.assertEqual(job.status, "succeeded")
+        self.assertGreater(db.get(Document, self.doc_id).num_chunks, 0)
+        db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()